@@ -0,0 +1,28 @@
+import sys
+import os
+import argparse
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config.templates import get_template_list, get_template_config
+from core.tuning import Autotuner, DEFAULT_TUNING_PATH
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本机自动调优：用实际模板校准并行数、线程数、PNG压缩级别和缓存容量")
+    parser.add_argument("templates", help="PSD模板目录")
+    parser.add_argument("patterns", help="印花图案目录")
+    parser.add_argument("--template", default=get_template_list()[0],
+                        help=f"模板键，可选: {', '.join(get_template_list())}")
+    parser.add_argument("--files", type=int, default=4, help="参与校准的模板数")
+    parser.add_argument("--output", default=DEFAULT_TUNING_PATH, help="调优配置文件")
+    args = parser.parse_args()
+
+    template_config = get_template_config(args.template)
+    if template_config is None:
+        sys.exit(f"错误: 未知模板 '{args.template}'")
+
+    try:
+        profile = Autotuner(template_config, args.templates, args.patterns, sample_files=args.files).run()
+    except (OSError, ValueError) as e:
+        sys.exit(f"错误: {e}")
+    profile.save(args.output)
+    print(f"已写入 {args.output}，PSDProcessor 和主界面启动时自动读取")
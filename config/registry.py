@@ -0,0 +1,149 @@
+# config/registry.py - 模板注册表（按需加载 templates/*.json）
+
+import os
+import json
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+REQUIRED_KEYS = ('name', 'layer_names', 'pattern_files', 'rotation_rules', 'position_rules')
+POSITION_KEYS = ('top_left', 'top_center')
+FILL_MODES = ('stretch', 'fit', 'tile')
+
+
+class TemplateValidationError(ValueError):
+    """模板配置不符合规范"""
+
+
+def validate_template_config(config):
+    """校验模板配置，失败时抛出 TemplateValidationError"""
+    if not isinstance(config, dict):
+        raise TemplateValidationError("模板配置必须是JSON对象")
+
+    missing = [key for key in REQUIRED_KEYS if key not in config]
+    if missing:
+        raise TemplateValidationError(f"缺少字段: {', '.join(missing)}")
+
+    layer_names = config['layer_names']
+    pattern_files = config['pattern_files']
+    if not isinstance(layer_names, list) or not isinstance(pattern_files, list):
+        raise TemplateValidationError("layer_names 和 pattern_files 必须是列表")
+    if len(layer_names) != len(pattern_files):
+        raise TemplateValidationError(
+            f"layer_names({len(layer_names)}) 与 pattern_files({len(pattern_files)}) 数量不匹配")
+    if len(set(layer_names)) != len(layer_names):
+        raise TemplateValidationError("layer_names 中存在重复图层")
+
+    for rule in config['rotation_rules']:
+        if not isinstance(rule, (list, tuple)) or len(rule) != 2:
+            raise TemplateValidationError(f"旋转规则格式错误: {rule}")
+        psd_name, layer_name = rule
+        if not str(psd_name).lower().endswith('.psd'):
+            raise TemplateValidationError(f"旋转规则引用的不是PSD文件: {psd_name}")
+        if layer_name not in layer_names:
+            raise TemplateValidationError(f"旋转规则引用了未配置的图层: {layer_name}")
+
+    position_rules = config['position_rules']
+    if not isinstance(position_rules, dict):
+        raise TemplateValidationError("position_rules 必须是对象")
+    for layer_name, position_key in position_rules.items():
+        if layer_name not in layer_names:
+            raise TemplateValidationError(f"位置规则引用了未配置的图层: {layer_name}")
+        if position_key not in POSITION_KEYS:
+            raise TemplateValidationError(f"未知的标签位置: {position_key}")
+
+    # 可选：每个图层的印花填充方式
+    fill_rules = config.get('fill_rules', {})
+    if not isinstance(fill_rules, dict):
+        raise TemplateValidationError("fill_rules 必须是对象")
+    for layer_name, rule in fill_rules.items():
+        if layer_name not in layer_names:
+            raise TemplateValidationError(f"填充规则引用了未配置的图层: {layer_name}")
+        if not isinstance(rule, dict) or rule.get('mode', 'stretch') not in FILL_MODES:
+            raise TemplateValidationError(f"图层 {layer_name} 的填充方式无效，可选: {', '.join(FILL_MODES)}")
+        if rule.get('mode') == 'tile':
+            repeat = rule.get('repeat_mm')
+            repeat_values = repeat if isinstance(repeat, (list, tuple)) else [repeat]
+            if len(repeat_values) not in (1, 2) or \
+                    not all(isinstance(v, (int, float)) and v > 0 for v in repeat_values):
+                raise TemplateValidationError(f"图层 {layer_name} 平铺需要正数 repeat_mm（宽或[宽, 高]）")
+            if not isinstance(rule.get('dpi'), (int, float)) or rule['dpi'] <= 0:
+                raise TemplateValidationError(f"图层 {layer_name} 平铺需要正数 dpi")
+            offset = rule.get('offset_mm', [0, 0])
+            if not isinstance(offset, (list, tuple)) or len(offset) != 2:
+                raise TemplateValidationError(f"图层 {layer_name} 的 offset_mm 必须是 [x, y]")
+
+
+def prepare_template_config(config):
+    """
+    预计算快速查找结构
+    - rotation_set: (PSD文件名, 图层名) 集合
+    - label_positions: 每个图层对应的标签位置（无规则为None）
+    - fill_rules: 图层填充规则（缺省为空，即全部拉伸）
+    """
+    prepared = dict(config)
+    prepared['rotation_rules'] = [tuple(rule) for rule in config['rotation_rules']]
+    prepared['rotation_set'] = frozenset(prepared['rotation_rules'])
+    prepared['label_positions'] = {name: config['position_rules'].get(name)
+                                   for name in config['layer_names']}
+    prepared['fill_rules'] = dict(config.get('fill_rules', {}))
+    return prepared
+
+
+class TemplateRegistry:
+    def __init__(self, templates_dir=TEMPLATES_DIR):
+        """
+        模板注册表
+        :param templates_dir: 模板JSON所在目录，模板键为文件名（不含扩展名）
+        """
+        self.templates_dir = templates_dir
+        self._cache = {}   # 模板键 -> (mtime, 配置)
+        self.errors = {}   # 模板键 -> 校验错误信息
+
+    def _path_for(self, key):
+        return os.path.join(self.templates_dir, f"{key}.json")
+
+    def discover(self):
+        """扫描模板目录，返回模板键列表（按文件名排序）"""
+        if not os.path.isdir(self.templates_dir):
+            return []
+        return sorted(os.path.splitext(f)[0] for f in os.listdir(self.templates_dir)
+                      if f.lower().endswith('.json'))
+
+    def get(self, key):
+        """获取模板配置，文件修改后自动重新加载；不存在或校验失败返回None"""
+        path = self._path_for(key)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self._cache.pop(key, None)
+            return None
+
+        cached = self._cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            validate_template_config(config)
+        except (ValueError, OSError) as e:
+            self.errors[key] = str(e)
+            self._cache[key] = (mtime, None)
+            return None
+
+        self.errors.pop(key, None)
+        prepared = prepare_template_config(config)
+        self._cache[key] = (mtime, prepared)
+        return prepared
+
+    def load_all(self):
+        """加载所有有效模板，返回 {模板键: 配置}"""
+        configs = {}
+        for key in self.discover():
+            config = self.get(key)
+            if config is not None:
+                configs[key] = config
+        return configs
+
+
+default_registry = TemplateRegistry()
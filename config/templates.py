@@ -1,5 +1,9 @@
 # config/templates.py - 模板配置管理
 
+from config.registry import default_registry, prepare_template_config
+
+# 内置模板；templates/*.json 中的同名模板优先
+
 TEMPLATE_CONFIGS = {
     "男装短袖": {
         "name": "男装短袖模板",
@@ -56,12 +60,20 @@ TEMPLATE_CONFIGS = {
 }
 
 def get_template_list():
-    """获取所有可用模板列表"""
-    return list(TEMPLATE_CONFIGS.keys())
+    """获取所有可用模板列表（内置模板 + templates/*.json）"""
+    keys = list(TEMPLATE_CONFIGS.keys())
+    for key in default_registry.discover():
+        if key not in keys:
+            keys.append(key)
+    return keys
 
 def get_template_config(template_name):
     """获取指定模板的配置"""
-    return TEMPLATE_CONFIGS.get(template_name, None)
+    config = default_registry.get(template_name)
+    if config is not None:
+        return config
+    config = TEMPLATE_CONFIGS.get(template_name)
+    return prepare_template_config(config) if config else None
 
 def add_custom_template(name, config):
     """添加自定义模板"""
@@ -69,5 +81,10 @@ def add_custom_template(name, config):
 
 def get_template_display_name(template_key):
     """获取模板显示名称"""
-    config = TEMPLATE_CONFIGS.get(template_key)
-    return config['name'] if config else template_key
\ No newline at end of file
+    config = get_template_config(template_key)
+    return config['name'] if config else template_key
+
+def get_template_errors():
+    """获取 templates/*.json 的校验错误 {模板键: 错误信息}"""
+    default_registry.load_all()
+    return dict(default_registry.errors)
@@ -0,0 +1,175 @@
+# core/color.py - 色彩管理：印花从源色彩空间转换到打印机ICC
+
+import io
+import os
+import time
+import hashlib
+import threading
+import cv2
+import numpy as np
+from PIL import Image, ImageCms
+
+INTENTS = {
+    'perceptual': 0,   # 可感知
+    'relative': 1,     # 相对比色
+    'saturation': 2,   # 饱和度
+    'absolute': 3,     # 绝对比色
+}
+
+# (源ICC哈希, 目标ICC哈希, 渲染意图) -> ImageCmsTransform，进程内所有处理器共用
+_transform_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _profile_digest(profile_bytes):
+    return hashlib.sha256(profile_bytes).hexdigest()
+
+
+def _is_rgb_profile(profile):
+    return profile.profile.xcolor_space.strip() == 'RGB'
+
+
+def get_transform(source_profile, source_digest, target_profile, target_digest, intent):
+    """获取缓存的转换，不存在时构建（LittleCMS构建一次后可反复使用）"""
+    key = (source_digest, target_digest, intent)
+    with _cache_lock:
+        transform = _transform_cache.get(key)
+        if transform is None:
+            transform = ImageCms.buildTransform(source_profile, target_profile, 'RGB', 'RGB',
+                                                renderingIntent=INTENTS[intent])
+            _transform_cache[key] = transform
+        return transform
+
+
+class ColorManager:
+    def __init__(self, printer_profile_path, source_profile_path=None, intent='perceptual', use_embedded=True):
+        """
+        印花色彩管理（源色彩空间 -> 打印机ICC）
+        :param printer_profile_path: 打印机/介质ICC文件，必须是RGB设备描述文件（输出仍为RGB PNG）
+        :param source_profile_path: 印花默认的源ICC，None 为 sRGB
+        :param intent: 渲染意图，可选 perceptual / relative / saturation / absolute
+        :param use_embedded: 印花内嵌RGB ICC时优先使用内嵌的描述文件
+        """
+        if intent not in INTENTS:
+            raise ValueError(f"未知的渲染意图: {intent}，可选: {', '.join(INTENTS)}")
+        self.printer_profile_path = printer_profile_path
+        self.source_profile_path = source_profile_path
+        self.intent = intent
+        self.use_embedded = use_embedded
+
+        self.printer_profile = ImageCms.getOpenProfile(printer_profile_path)
+        if not _is_rgb_profile(self.printer_profile):
+            raise ValueError(f"打印机ICC必须是RGB描述文件: {os.path.basename(printer_profile_path)}")
+        self.printer_profile_bytes = self.printer_profile.tobytes()
+        self.printer_digest = _profile_digest(self.printer_profile_bytes)
+
+        if source_profile_path:
+            self.source_profile = ImageCms.getOpenProfile(source_profile_path)
+            if not _is_rgb_profile(self.source_profile):
+                raise ValueError(f"源ICC必须是RGB描述文件: {os.path.basename(source_profile_path)}")
+        else:
+            self.source_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+        self.source_digest = _profile_digest(self.source_profile.tobytes())
+
+        self.stats = {'images': 0, 'pixels': 0, 'seconds': 0.0}
+
+    @property
+    def key(self):
+        """影响输出的色彩设置，用于输出缓存键"""
+        return {'printer': self.printer_digest, 'source': self.source_digest,
+                'intent': self.intent, 'use_embedded': self.use_embedded}
+
+    def transform_for(self, image):
+        """按印花内嵌ICC（如有）选择转换"""
+        embedded = image.info.get('icc_profile') if self.use_embedded else None
+        if embedded:
+            digest = _profile_digest(embedded)
+            if digest != self.source_digest:
+                try:
+                    profile = ImageCms.ImageCmsProfile(io.BytesIO(embedded))
+                except (OSError, ImageCms.PyCMSError):
+                    profile = None
+                if profile is not None and _is_rgb_profile(profile):
+                    return get_transform(profile, digest, self.printer_profile, self.printer_digest, self.intent)
+        return get_transform(self.source_profile, self.source_digest,
+                             self.printer_profile, self.printer_digest, self.intent)
+
+    def convert(self, image):
+        """
+        就地把RGB图像转换到打印机色彩空间
+        :param image: PIL RGB图像
+        :return: 转换后的图像（同一对象）
+        """
+        start = time.perf_counter()
+        ImageCms.applyTransform(image, self.transform_for(image), inPlace=True)
+        self.stats['images'] += 1
+        self.stats['pixels'] += image.width * image.height
+        self.stats['seconds'] += time.perf_counter() - start
+        return image
+
+    def convert_array(self, bgr, icc_profile=None):
+        """
+        就地转换BGR数组（已填充的裁片或共享印花的副本）
+        :param icc_profile: 印花内嵌的ICC（数组不带图像信息，由调用方传入）
+        """
+        image = Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+        if icc_profile:
+            image.info['icc_profile'] = icc_profile
+        image = self.convert(image)
+        cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR, dst=bgr)
+        return bgr
+
+    def settings(self):
+        """构造参数（可序列化），ColorManager(**settings) 可在其它进程或节点上重建"""
+        return {'printer_profile_path': self.printer_profile_path,
+                'source_profile_path': self.source_profile_path,
+                'intent': self.intent, 'use_embedded': self.use_embedded}
+
+    def __getstate__(self):
+        # ICC对象不能pickle，子进程按路径重新加载（转换在子进程内各自缓存）
+        return self.settings()
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def benchmark_color_stage(processor, template_psd_path, pattern_folder_path):
+    """
+    对比两种位置的色彩转换开销：在印花/裁片阶段转换（当前流程）vs 在最终整幅画布上转换
+    :param processor: 已设置 color_manager 的 PSDProcessor
+    :return: 报告字典
+    """
+    color_manager = processor.color_manager
+
+    # 方式一：印花/裁片阶段转换（当前流程）
+    color_manager.stats = {'images': 0, 'pixels': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    processor.render_template(template_psd_path, pattern_folder_path)
+    pattern_render_seconds = time.perf_counter() - start
+    pattern_stats = dict(color_manager.stats)
+
+    # 方式二：不转换印花，渲染后转换整幅画布
+    processor.color_manager = None
+    try:
+        start = time.perf_counter()
+        canvas = processor.render_template(template_psd_path, pattern_folder_path)
+        plain_render_seconds = time.perf_counter() - start
+    finally:
+        processor.color_manager = color_manager
+    if canvas is None:
+        return None
+    canvas = canvas.convert('RGB')
+    start = time.perf_counter()
+    ImageCms.applyTransform(canvas, color_manager.transform_for(canvas), inPlace=True)
+    canvas_seconds = time.perf_counter() - start
+
+    return {
+        'file': os.path.basename(template_psd_path),
+        'converted_images': pattern_stats['images'],
+        'converted_pixels': pattern_stats['pixels'],
+        'convert_seconds': pattern_stats['seconds'],
+        'pattern_render_seconds': pattern_render_seconds,
+        'canvas_pixels': canvas.width * canvas.height,
+        'canvas_seconds': canvas_seconds,
+        'canvas_render_seconds': plain_render_seconds + canvas_seconds,
+    }
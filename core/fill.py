@@ -0,0 +1,97 @@
+# core/fill.py - 印花填充方式：拉伸 / 等比填满 / 按实际尺寸平铺
+
+import math
+import cv2
+import numpy as np
+
+MM_PER_INCH = 25.4
+
+
+def mm_to_px(mm, dpi, scale=1.0):
+    return max(1, round(mm / MM_PER_INCH * dpi * scale))
+
+
+def tile_size(rule, pattern_size, scale=1.0):
+    """
+    计算平铺单元的像素尺寸
+    :param rule: 填充规则，repeat_mm 为 [宽, 高] 或单个宽度（高度按印花宽高比）
+    :param pattern_size: 印花原始 (宽, 高)，只用于宽高比
+    """
+    repeat = rule['repeat_mm']
+    dpi = rule['dpi']
+    if isinstance(repeat, (list, tuple)):
+        return mm_to_px(repeat[0], dpi, scale), mm_to_px(repeat[1], dpi, scale)
+    tile_w = mm_to_px(repeat, dpi, scale)
+    pattern_w, pattern_h = pattern_size
+    return tile_w, max(1, round(tile_w * pattern_h / pattern_w))
+
+
+def pattern_target_size(rule, piece_size, scale=1.0):
+    """印花至少需要解码到的尺寸（用于缩小解码）"""
+    if rule and rule.get('mode') == 'tile':
+        repeat = rule['repeat_mm']
+        if isinstance(repeat, (list, tuple)):
+            return mm_to_px(repeat[0], rule['dpi'], scale), mm_to_px(repeat[1], rule['dpi'], scale)
+        return mm_to_px(repeat, rule['dpi'], scale), 1
+    return piece_size
+
+
+def fill_stretch(pattern, size, interpolation=cv2.INTER_LINEAR):
+    """拉伸到裁片尺寸（原有方式）"""
+    return cv2.resize(pattern, size, interpolation=interpolation)
+
+
+def fill_fit(pattern, size, interpolation=cv2.INTER_LINEAR):
+    """等比缩放至完全覆盖裁片，居中裁掉多余部分，不变形"""
+    w, h = size
+    pattern_h, pattern_w = pattern.shape[:2]
+    ratio = max(w / pattern_w, h / pattern_h)
+    scaled_w, scaled_h = max(w, math.ceil(pattern_w * ratio)), max(h, math.ceil(pattern_h * ratio))
+    if scaled_w < pattern_w:
+        interpolation = cv2.INTER_AREA
+    scaled = cv2.resize(pattern, (scaled_w, scaled_h), interpolation=interpolation)
+    x0, y0 = (scaled_w - w) // 2, (scaled_h - h) // 2
+    return np.ascontiguousarray(scaled[y0:y0 + h, x0:x0 + w])
+
+
+def fill_tile(pattern, size, rule, scale=1.0, interpolation=cv2.INTER_LINEAR):
+    """
+    按实际循环尺寸平铺：只缩放一个单元，再按块复制铺满
+    规则字段: repeat_mm, dpi, offset_mm=[x, y]（可选）, half_drop（可选，隔列下移半个单元）
+    """
+    w, h = size
+    pattern_h, pattern_w = pattern.shape[:2]
+    tile_w, tile_h = tile_size(rule, (pattern_w, pattern_h), scale)
+    if tile_w < pattern_w:
+        interpolation = cv2.INTER_AREA
+    tile = cv2.resize(pattern, (tile_w, tile_h), interpolation=interpolation)
+
+    if rule.get('half_drop'):
+        # 两列为一个循环，第二列下移半个单元
+        tile = np.hstack((tile, np.roll(tile, tile_h // 2, axis=0)))
+    period_h, period_w = tile.shape[:2]
+
+    offset_x, offset_y = rule.get('offset_mm', (0, 0))
+    px_per_mm = rule['dpi'] / MM_PER_INCH * scale
+    start_x = -round(offset_x * px_per_mm) % period_w
+    start_y = -round(offset_y * px_per_mm) % period_h
+
+    reps_y = math.ceil((h + start_y) / period_h)
+    reps_x = math.ceil((w + start_x) / period_w)
+    tiled = np.tile(tile, (reps_y, reps_x, 1))
+    return np.ascontiguousarray(tiled[start_y:start_y + h, start_x:start_x + w])
+
+
+def fill_pattern(pattern, size, rule=None, scale=1.0, interpolation=cv2.INTER_LINEAR):
+    """
+    按填充规则生成与裁片同尺寸的印花
+    :param pattern: BGR印花数组
+    :param size: 裁片 (宽, 高)
+    :param rule: 图层的填充规则，None 为拉伸
+    """
+    mode = rule.get('mode', 'stretch') if rule else 'stretch'
+    if mode == 'fit':
+        return fill_fit(pattern, size, interpolation)
+    if mode == 'tile':
+        return fill_tile(pattern, size, rule, scale, interpolation)
+    return fill_stretch(pattern, size, interpolation)
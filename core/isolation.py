@@ -0,0 +1,269 @@
+# core/isolation.py - 故障隔离：每个模板在受监控的子进程中处理，限制耗时和内存
+
+import os
+import sys
+import time
+import multiprocessing
+from collections import deque
+
+# 失败分类 -> 日志中的说明
+FAILURE_KINDS = {
+    'timeout': '超时',
+    'oom': '内存超限',
+    'over_budget': '超出内存预算',
+    'parse_error': '文件损坏或无法解析',
+    'io_error': '文件读写失败',
+    'crash': '子进程异常退出',
+    'error': '处理出错',
+    'failed': '未生成输出',
+}
+# 可能是偶发的失败才重试（读写失败多为网络共享抖动或磁盘临时写满）；解析错误和普通错误重试也不会成功
+RETRYABLE_KINDS = ('timeout', 'oom', 'crash', 'io_error')
+
+
+class TemplateParseError(ValueError):
+    """PSD模板无法解析（文件损坏、截断或格式不支持），由 PSDProcessor 打开和合成模板时抛出"""
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """内存预算模式下单个文件的内存峰值超出预算，由 PSDProcessor 中止该文件时抛出（结果确定，不重试）"""
+
+
+class IsolationPolicy:
+    def __init__(self, timeout=600, max_rss_mb=None, max_retries=1, retry_kinds=RETRYABLE_KINDS):
+        """
+        隔离模式的限制
+        :param timeout: 单个文件的最长处理时间(秒)，超时强制结束子进程
+        :param max_rss_mb: 子进程常驻内存上限(MB)，超出强制结束；None 为不限
+        :param max_retries: 可重试失败的最多重试次数（重试排在批次最后，内存超限的单独重试）
+        :param retry_kinds: 需要重试的失败类型
+        """
+        self.timeout = timeout
+        self.max_rss_mb = max_rss_mb
+        self.max_retries = max_retries
+        self.retry_kinds = tuple(retry_kinds)
+
+
+def classify_error(error):
+    """
+    按子进程内捕获的异常划分失败类型
+    只有解析模板时标记的 TemplateParseError 算文件损坏；其它读写错误（磁盘满、无权限等）单独归类
+    """
+    if error is None:
+        return 'failed'
+    if isinstance(error, MemoryBudgetExceeded):
+        return 'over_budget'
+    if isinstance(error, MemoryError):
+        return 'oom'
+    if isinstance(error, TemplateParseError):
+        return 'parse_error'
+    if isinstance(error, OSError):
+        return 'io_error'
+    return 'error'
+
+
+def _rss_linux(pid):
+    with open(f"/proc/{pid}/statm", 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _rss_windows(pid):
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    PROCESS_QUERY_LIMITED_INFORMATION, PROCESS_VM_READ = 0x1000, 0x0010
+    handle = ctypes.windll.kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION | PROCESS_VM_READ, False, pid)
+    if not handle:
+        return None
+    try:
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+    finally:
+        ctypes.windll.kernel32.CloseHandle(handle)
+
+
+def process_rss(pid):
+    """子进程当前常驻内存(字节)，无法获取时返回None"""
+    try:
+        if sys.platform.startswith('linux'):
+            return _rss_linux(pid)
+        if sys.platform == 'win32':
+            return _rss_windows(pid)
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+class _WorkerSlot:
+    """一个常驻子进程，连续处理多个任务；超时或超内存时结束并在下个任务前重启"""
+
+    def __init__(self, context, worker_main, init_args):
+        self.context = context
+        self.worker_main = worker_main
+        self.init_args = init_args
+        self.process = None
+        self.conn = None
+        self.task = None        # (任务, 第几次尝试, 是否单独运行)
+        self.started_at = None
+        self.peak_rss = 0
+
+    def start(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=self.worker_main, args=(child_conn,) + self.init_args,
+                                            daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def submit(self, task, attempt, exclusive):
+        if self.process is None or not self.process.is_alive():
+            self.start()
+        self.task = (task, attempt, exclusive)
+        self.started_at = time.monotonic()
+        self.peak_rss = 0
+        self.conn.send(task)
+
+    def kill(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+
+
+class SupervisedPool:
+    def __init__(self, worker_main, init_args, policy, workers=1, log_callback=None, poll_interval=0.2):
+        """
+        受监控的子进程池
+        :param worker_main: 子进程入口 worker_main(conn, *init_args)：循环 conn.recv() 得到任务（None 表示退出），
+                            处理后 conn.send({'ok', 'messages', 'kind', 'error'})
+        :param policy: IsolationPolicy
+        :param workers: 同时运行的子进程数
+        """
+        self.worker_main = worker_main
+        self.init_args = tuple(init_args)
+        self.policy = policy
+        self.workers = max(1, workers)
+        self.log_callback = log_callback or print
+        self.poll_interval = poll_interval
+        self.context = multiprocessing.get_context()
+
+    def log(self, message):
+        self.log_callback(message)
+
+    def _check(self, slot):
+        """检查运行中的任务，结束时返回结果字典，否则返回None"""
+        task, _, _ = slot.task
+        elapsed = time.monotonic() - slot.started_at
+        try:
+            if slot.conn.poll():
+                result = slot.conn.recv()
+                if result.get('kind') == 'oom':
+                    slot.kill()  # MemoryError 之后进程状态不可靠，换新进程
+                return result
+        except (EOFError, OSError):
+            pass
+        else:
+            if slot.process.is_alive():
+                if elapsed > self.policy.timeout:
+                    slot.kill()
+                    return {'ok': False, 'messages': [], 'kind': 'timeout',
+                            'error': f"超过 {self.policy.timeout:g}s 未完成"}
+                if self.policy.max_rss_mb is not None:
+                    rss = process_rss(slot.process.pid)
+                    if rss is not None:
+                        slot.peak_rss = max(slot.peak_rss, rss)
+                        if rss > self.policy.max_rss_mb * 1024 ** 2:
+                            slot.kill()
+                            return {'ok': False, 'messages': [], 'kind': 'oom',
+                                    'error': f"常驻内存 {rss / 1024 ** 2:.0f} MB 超过上限 "
+                                             f"{self.policy.max_rss_mb:g} MB"}
+                return None
+        exitcode = slot.process.exitcode if slot.process is not None else None
+        slot.kill()
+        return {'ok': False, 'messages': [], 'kind': 'crash', 'error': f"子进程退出码 {exitcode}"}
+
+    def run(self, tasks, task_name=str, on_result=None):
+        """
+        处理全部任务，单个任务失败不影响其它任务
+        :param tasks: 任务列表（可pickle，原样发给子进程）
+        :param task_name: 任务 -> 日志中的名称
+        :param on_result: 每个任务最终结果的回调 on_result(任务, 结果)
+        :return: [(任务, 结果)]，结果额外包含 attempts 和 seconds
+        """
+        if self.policy.max_rss_mb is not None and process_rss(os.getpid()) is None:
+            self.log("⚠️ 当前平台无法读取进程内存，内存上限只能依靠子进程内的 MemoryError")
+
+        queue = deque((task, 1, False) for task in tasks)
+        slots = [_WorkerSlot(self.context, self.worker_main, self.init_args)
+                 for _ in range(min(self.workers, len(tasks)))]
+        results = []
+        try:
+            while queue or any(slot.task for slot in slots):
+                busy = [slot for slot in slots if slot.task]
+                exclusive_running = any(slot.task[2] for slot in busy)
+                for slot in slots:
+                    if slot.task or not queue or exclusive_running:
+                        continue
+                    if queue[0][2] and any(s.task for s in slots):
+                        break  # 单独重试的任务要等其它任务都结束
+                    slot.submit(*queue.popleft())
+                    exclusive_running = slot.task[2]
+
+                progressed = False
+                for slot in slots:
+                    if not slot.task:
+                        continue
+                    result = self._check(slot)
+                    if result is None:
+                        continue
+                    progressed = True
+                    task, attempt, _ = slot.task
+                    result.update(attempts=attempt, seconds=time.monotonic() - slot.started_at)
+                    slot.task = None
+
+                    kind = result.get('kind')
+                    if not result['ok'] and kind in self.policy.retry_kinds and attempt <= self.policy.max_retries:
+                        self.log(f"⚠️ {task_name(task)} {FAILURE_KINDS.get(kind, kind)}"
+                                 f"（{result.get('error')}），稍后重试")
+                        # 排到最后，不阻塞其它文件；内存超限的单独运行
+                        queue.append((task, attempt + 1, kind == 'oom'))
+                        continue
+                    results.append((task, result))
+                    if on_result is not None:
+                        on_result(task, result)
+                if not progressed:
+                    time.sleep(self.poll_interval)
+        finally:
+            for slot in slots:
+                if slot.task:
+                    slot.kill()
+                else:
+                    slot.stop()
+        return results
@@ -0,0 +1,426 @@
+# core/job_queue.py - 共享目录任务队列：多台渲染节点分摊同一批PSD
+
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import threading
+from config.registry import REQUIRED_KEYS, validate_template_config, prepare_template_config
+from core.processor import PSDProcessor
+from core.output_store import OutputStore
+from core.color import ColorManager
+from core.staging import StagingCache
+from core.tuning import load_tuning
+
+PENDING, LEASES, DONE = 'pending', 'leases', 'done'
+
+
+def _write_json(path, data):
+    """先写临时文件再替换，读者只会看到完整内容"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _unit_files(directory):
+    """目录中的任务文件名（忽略临时文件），按名称排序即按提交顺序"""
+    try:
+        return sorted(f for f in os.listdir(directory) if f.endswith('.json') and not f.startswith('.'))
+    except FileNotFoundError:
+        return []
+
+
+def default_node_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class JobQueue:
+    def __init__(self, queue_dir, lease_timeout=60, max_attempts=3):
+        """
+        基于共享目录的任务队列（同一台机器上用本地目录即可作为替代）
+        每个批次一个目录，任务文件在 pending -> leases -> done 之间用原子重命名流转：
+        - 领取：pending/x.json 重命名到本次领取独有的 leases/x~<领取ID>.json，只有一个节点能成功；
+          租约内记录令牌（节点、第几次尝试、领取ID），心跳和提交都只认自己的租约
+        - 心跳：节点定期更新租约文件的修改时间
+        - 回收：租约超过 lease_timeout 未更新视为节点失联，放回 pending（超过 max_attempts 次记为失败）
+        :param queue_dir: 所有节点都能访问的共享目录
+        :param lease_timeout: 租约超时(秒)
+        :param max_attempts: 单个任务最多领取次数
+        """
+        self.queue_dir = queue_dir
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        os.makedirs(queue_dir, exist_ok=True)
+
+    def _batch_dir(self, batch_id):
+        return os.path.join(self.queue_dir, batch_id)
+
+    def batches(self):
+        """未删除的批次，按提交顺序"""
+        return sorted(d for d in os.listdir(self.queue_dir)
+                      if os.path.isfile(os.path.join(self.queue_dir, d, 'batch.json')))
+
+    def batch_info(self, batch_id):
+        return _read_json(os.path.join(self._batch_dir(batch_id), 'batch.json'))
+
+    def fs_now(self):
+        """共享文件系统的当前时间（各节点时钟可能不一致，统一以文件修改时间为准）"""
+        clock_path = os.path.join(self.queue_dir, f".clock-{socket.gethostname()}")
+        with open(clock_path, 'w'):
+            pass
+        return os.stat(clock_path).st_mtime
+
+    def submit(self, template_config, jobs, options=None):
+        """
+        提交一个批次，每个 (印花目录, 尺码PSD) 为一个任务
+        :param jobs: [(PSD模板路径, 印花目录, 输出目录)]，路径必须是各节点都能访问的共享路径
+        :param options: 渲染选项（memory_budget_mb, color, output_store, staging）
+        :return: 批次ID
+        """
+        batch_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        batch_dir = self._batch_dir(batch_id)
+        for state in (PENDING, LEASES, DONE):
+            os.makedirs(os.path.join(batch_dir, state))
+
+        # 只保存原始配置字段，节点加载后重新校验和预计算
+        config = {key: template_config[key] for key in REQUIRED_KEYS}
+        config['fill_rules'] = template_config.get('fill_rules', {})
+        for index, (template_path, pattern_dir, output_dir) in enumerate(jobs):
+            unit_id = f"{index:05d}"
+            _write_json(os.path.join(batch_dir, PENDING, f"{unit_id}.json"), {
+                'batch': batch_id,
+                'unit': unit_id,
+                'template_path': template_path,
+                'pattern_dir': pattern_dir,
+                'output_dir': output_dir,
+                'attempts': 0,
+            })
+        # batch.json 最后写入，节点看到它时任务已全部就绪
+        _write_json(os.path.join(batch_dir, 'batch.json'), {
+            'template_config': config,
+            'options': options or {},
+            'total': len(jobs),
+            'submitted_at': time.time(),
+        })
+        return batch_id
+
+    def claim(self, node_id):
+        """领取一个任务，没有可领取的任务返回None"""
+        for batch_id in self.batches():
+            batch_dir = self._batch_dir(batch_id)
+            for name in _unit_files(os.path.join(batch_dir, PENDING)):
+                pending_path = os.path.join(batch_dir, PENDING, name)
+                claim_id = uuid.uuid4().hex[:12]
+                lease_path = os.path.join(batch_dir, LEASES, f"{name[:-5]}~{claim_id}.json")
+                try:
+                    # 先刷新修改时间，避免刚领取的租约被当成超时回收
+                    os.utime(pending_path)
+                    os.rename(pending_path, lease_path)
+                except OSError:
+                    continue  # 已被其它节点领取
+                unit = _read_json(lease_path)
+                if unit is None:
+                    continue
+                attempts = unit['attempts'] + 1
+                unit.update(attempts=attempts, node=node_id, claimed_at=time.time(), claim_id=claim_id,
+                            token=f"{node_id}/{attempts}/{claim_id}")
+                _write_json(lease_path, unit)
+                return unit
+        return None
+
+    def _lease_path(self, unit):
+        return os.path.join(self._batch_dir(unit['batch']), LEASES, f"{unit['unit']}~{unit['claim_id']}.json")
+
+    def _owns(self, unit, path):
+        """path 处的租约是否仍属于这次领取"""
+        lease = _read_json(path)
+        return lease is not None and lease.get('token') == unit['token']
+
+    def heartbeat(self, unit):
+        """续租，租约已被回收（或已交给其它节点）时返回False"""
+        lease_path = self._lease_path(unit)
+        if not self._owns(unit, lease_path):
+            return False
+        try:
+            os.utime(lease_path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, unit, ok, messages=None, seconds=None):
+        """
+        提交任务结果
+        :return: 租约仍有效并成功提交返回True；租约已被回收（任务已交给其它节点）返回False
+        """
+        done_dir = os.path.join(self._batch_dir(unit['batch']), DONE)
+        lease_path = self._lease_path(unit)
+        if not self._owns(unit, lease_path):
+            return False
+        # 先把自己的租约原子地移到不可见的临时名（与回收互斥），写好结果再换成正式名
+        finishing_path = os.path.join(done_dir, f".{unit['unit']}~{unit['claim_id']}.finishing")
+        try:
+            os.rename(lease_path, finishing_path)
+        except OSError:
+            return False
+        _write_json(finishing_path, dict(unit, ok=ok, messages=messages or [], seconds=seconds,
+                                         finished_at=time.time()))
+        os.replace(finishing_path, os.path.join(done_dir, f"{unit['unit']}.json"))
+        return True
+
+    def requeue_expired(self):
+        """回收超时租约，返回放回队列的任务数（任何节点都可以执行）"""
+        now = self.fs_now()
+        requeued = 0
+        for batch_id in self.batches():
+            batch_dir = self._batch_dir(batch_id)
+            lease_dir = os.path.join(batch_dir, LEASES)
+            for name in _unit_files(lease_dir):
+                lease_path = os.path.join(lease_dir, name)
+                try:
+                    if now - os.stat(lease_path).st_mtime < self.lease_timeout:
+                        continue
+                    # 先移到不可领取的临时名，改完尝试次数再放回
+                    staging_path = os.path.join(batch_dir, PENDING, f".{name}.requeue")
+                    os.rename(lease_path, staging_path)
+                except OSError:
+                    continue
+                unit_name = name.split('~')[0] + '.json'
+                unit = _read_json(staging_path) or {'batch': batch_id, 'unit': unit_name[:-5], 'attempts': 0}
+                for key in ('node', 'claimed_at', 'claim_id', 'token'):
+                    unit.pop(key, None)
+                if unit['attempts'] >= self.max_attempts:
+                    _write_json(staging_path, dict(unit, ok=False, finished_at=time.time(), messages=[
+                        f"❌ {os.path.basename(unit.get('template_path', unit_name))} "
+                        f"节点失联 {unit['attempts']} 次，放弃处理"]))
+                    os.replace(staging_path, os.path.join(batch_dir, DONE, unit_name))
+                else:
+                    _write_json(staging_path, unit)
+                    os.replace(staging_path, os.path.join(batch_dir, PENDING, unit_name))
+                    requeued += 1
+            # 回收过程中中断留下的临时文件
+            for name in os.listdir(os.path.join(batch_dir, PENDING)):
+                if name.startswith('.') and name.endswith('.requeue'):
+                    staging_path = os.path.join(batch_dir, PENDING, name)
+                    try:
+                        if now - os.stat(staging_path).st_mtime >= self.lease_timeout:
+                            unit_name = name[1:-len('.requeue')].split('~')[0] + '.json'
+                            os.replace(staging_path, os.path.join(batch_dir, PENDING, unit_name))
+                    except OSError:
+                        pass
+            # 提交过程中中断：结果已写好的补完提交，否则放回待处理
+            done_dir = os.path.join(batch_dir, DONE)
+            for name in os.listdir(done_dir):
+                if name.startswith('.') and name.endswith('.finishing'):
+                    finishing_path = os.path.join(done_dir, name)
+                    unit_name = name[1:].split('~')[0] + '.json'
+                    try:
+                        if now - os.stat(finishing_path).st_mtime < self.lease_timeout:
+                            continue
+                        if 'ok' in (_read_json(finishing_path) or {}):
+                            os.replace(finishing_path, os.path.join(done_dir, unit_name))
+                        else:
+                            os.replace(finishing_path, os.path.join(batch_dir, PENDING, unit_name))
+                            requeued += 1
+                    except OSError:
+                        pass
+        return requeued
+
+    def status(self, batch_id):
+        """批次进度 {'pending', 'running', 'done', 'total'}"""
+        batch_dir = self._batch_dir(batch_id)
+        return {
+            'pending': len(_unit_files(os.path.join(batch_dir, PENDING))),
+            'running': len(_unit_files(os.path.join(batch_dir, LEASES))),
+            'done': len(_unit_files(os.path.join(batch_dir, DONE))),
+            'total': (self.batch_info(batch_id) or {}).get('total', 0),
+        }
+
+    def results(self, batch_id):
+        """已完成任务的结果 {任务ID: 结果}"""
+        done_dir = os.path.join(self._batch_dir(batch_id), DONE)
+        results = {}
+        for name in _unit_files(done_dir):
+            result = _read_json(os.path.join(done_dir, name))
+            if result is not None and 'ok' in result:
+                results[name[:-5]] = result
+        return results
+
+    def wait(self, batch_id, log_callback=None, poll_interval=2.0, timeout=None, stall_leases=3):
+        """
+        协调端：等待批次完成，期间回收失联节点的任务并转发各任务日志
+        :param timeout: 最长等待时间(秒)，超时后不再等待未完成的任务；None 为不限
+        :param stall_leases: 没有节点在处理、且这么多个租约周期内没有任务完成时提示检查渲染节点
+        :return: (成功数, 总数)，超时时成功数只计已完成的任务
+        """
+        log = log_callback or print
+        total = self.batch_info(batch_id)['total']
+        reported = set()
+        start = last_progress = time.monotonic()
+        warned = False
+        while True:
+            self.requeue_expired()
+            results = self.results(batch_id)
+            for unit_id in sorted(set(results) - reported):
+                result = results[unit_id]
+                for message in result['messages']:
+                    log(f"[{result.get('node', '-')}] {message}")
+                reported.add(unit_id)
+                last_progress = time.monotonic()
+                warned = False
+            success_count = sum(1 for r in results.values() if r['ok'])
+            if len(results) >= total:
+                return success_count, total
+
+            now = time.monotonic()
+            if timeout is not None and now - start > timeout:
+                log(f"❌ 等待超时（{timeout:g}s）: 完成 {len(results)}/{total}，未完成的任务不再等待")
+                return success_count, total
+            # 有租约说明有节点在处理（失联节点的租约会被回收），没有租约又长时间无进展多半是没有节点在线
+            if self.status(batch_id)['running'] > 0:
+                last_progress = now
+            elif not warned and now - last_progress > stall_leases * self.lease_timeout:
+                log(f"⚠️ 已 {now - last_progress:.0f}s 没有渲染节点处理任务（完成 {len(results)}/{total}），"
+                    f"请检查渲染节点是否在运行")
+                warned = True
+            time.sleep(poll_interval)
+
+    def remove_batch(self, batch_id):
+        """删除已完成批次的队列文件"""
+        shutil.rmtree(self._batch_dir(batch_id), ignore_errors=True)
+
+    def process_directory(self, processor, template_dir, pattern_dir, output_dir, poll_interval=2.0, timeout=None):
+        """
+        协调端：与 PSDProcessor.process_directory 相同的批量处理，但每个PSD作为一个任务
+        发布到队列，由各渲染节点领取处理
+        :param processor: 提供模板配置、渲染选项和日志的 PSDProcessor
+        :param timeout: 最长等待时间(秒)，None 为不限
+        :return: (成功数, 总数)
+        """
+        psd_files = sorted(f for f in os.listdir(template_dir) if f.lower().endswith('.psd'))
+        if not psd_files:
+            processor.log("错误: 模板目录中未找到PSD文件")
+            return 0, 0
+
+        options = {
+            'output_store': processor.output_store is not None,
+            'staging': processor.staging_cache is not None,
+            'memory_budget_mb': processor.memory_budget_mb,
+            'color': processor.color_manager.settings() if processor.color_manager is not None else None,
+        }
+        jobs = [(os.path.join(template_dir, filename), pattern_dir, output_dir) for filename in psd_files]
+        batch_id = self.submit(processor.config, jobs, options)
+        processor.log(f"已发布批次 {batch_id}: {len(jobs)} 个任务，等待渲染节点处理")
+
+        try:
+            success_count, total = self.wait(batch_id, processor.log, poll_interval, timeout=timeout)
+        finally:
+            self.remove_batch(batch_id)
+        processor.log(f"批量处理完成: 成功 {success_count}/{total}")
+        return success_count, total
+
+
+class RenderNode:
+    def __init__(self, queue, node_id=None, log_callback=None, heartbeat_interval=None):
+        """
+        渲染节点：循环领取任务、处理并提交结果
+        :param queue: JobQueue
+        :param heartbeat_interval: 心跳间隔(秒)，默认为租约超时的1/3
+        节点按本机的调优配置(data/tuning.json)设置线程数、压缩级别和缓存容量
+        """
+        self.queue = queue
+        self.node_id = node_id or default_node_id()
+        self.log_callback = log_callback or print
+        self.heartbeat_interval = heartbeat_interval or max(1.0, queue.lease_timeout / 3)
+        self.tuning = load_tuning()
+        self._processors = {}  # 批次ID -> PSDProcessor
+        self.completed = 0
+
+    def log(self, message):
+        self.log_callback(message)
+
+    def _processor_for(self, batch_id, messages):
+        """每个批次创建一次处理器（模板配置、色彩转换等在批次内复用），只保留当前批次"""
+        processor = self._processors.get(batch_id)
+        if processor is None:
+            batch = self.queue.batch_info(batch_id)
+            config = batch['template_config']
+            validate_template_config(config)
+            options = batch['options']
+            color = options.get('color')
+            processor = PSDProcessor(
+                prepare_template_config(config),
+                output_store=OutputStore(max_bytes=self.tuning.output_store_max_bytes)
+                if options.get('output_store') else None,
+                memory_budget_mb=options.get('memory_budget_mb'),
+                color_manager=ColorManager(**color) if color else None,
+                staging_cache=StagingCache(max_bytes=self.tuning.staging_max_bytes,
+                                           workers=self.tuning.staging_workers) if options.get('staging') else None,
+                tuning=self.tuning)
+            self._processors = {batch_id: processor}
+        processor.log_callback = messages.append
+        return processor
+
+    def process_unit(self, unit):
+        """处理一个已领取的任务，处理期间后台线程持续续租"""
+        messages = []
+        stop = threading.Event()
+
+        def keep_alive():
+            while not stop.wait(self.heartbeat_interval):
+                if not self.queue.heartbeat(unit):
+                    self.log(f"⚠️ 任务 {unit['batch']}/{unit['unit']} 的租约已被回收")
+                    return
+
+        heartbeat = threading.Thread(target=keep_alive, daemon=True)
+        heartbeat.start()
+        start = time.perf_counter()
+        try:
+            processor = self._processor_for(unit['batch'], messages)
+            os.makedirs(unit['output_dir'], exist_ok=True)
+            ok = processor.process_single_template(unit['template_path'], unit['pattern_dir'], unit['output_dir'])
+        except Exception as e:
+            ok = False
+            messages.append(f"❌ 处理 {os.path.basename(unit['template_path'])} 时发生错误: {str(e)}")
+        finally:
+            stop.set()
+            heartbeat.join()
+        seconds = time.perf_counter() - start
+
+        for message in messages:
+            self.log(message)
+        if self.queue.complete(unit, ok, messages, seconds):
+            self.completed += 1
+        else:
+            self.log(f"⚠️ 任务 {unit['batch']}/{unit['unit']} 已交给其它节点，丢弃本次结果")
+        return ok
+
+    def run(self, poll_interval=2.0, exit_when_idle=False):
+        """
+        节点主循环
+        :param exit_when_idle: 队列中没有待处理任务时退出（否则一直等待新批次）
+        """
+        self.log(f"渲染节点 {self.node_id} 已启动，队列: {self.queue.queue_dir}")
+        while True:
+            unit = self.queue.claim(self.node_id)
+            if unit is None:
+                # 空闲时顺带回收失联节点的任务
+                if self.queue.requeue_expired():
+                    continue
+                if exit_when_idle:
+                    break
+                time.sleep(poll_interval)
+                continue
+            self.process_unit(unit)
+        self.log(f"渲染节点 {self.node_id} 退出，共完成 {self.completed} 个任务")
+        return self.completed
@@ -0,0 +1,218 @@
+# core/nesting.py - 排料：把多个尺码/订单的裁片排到固定幅宽的卷料上
+
+import os
+import math
+import time
+import shutil
+import tempfile
+import cv2
+import numpy as np
+from core.png_stream import PNGStreamWriter
+
+
+class MarkerNester:
+    def __init__(self, roll_width_px, gap_px=0, max_length_px=None, cell_px=None,
+                 allow_rotation=True, work_dir=None):
+        """
+        基于降采样位图碰撞检测的排料引擎
+        :param roll_width_px: 卷料幅宽（像素）
+        :param gap_px: 裁片之间的最小间距（像素）
+        :param max_length_px: 单卷最大长度，超出后开新卷；None 为不限
+        :param cell_px: 碰撞网格大小，默认使幅宽约为512格
+        :param allow_rotation: 是否允许180°旋转
+        :param work_dir: 裁片临时文件目录（裁片落盘后按内存映射读取）
+        """
+        self.roll_width_px = roll_width_px
+        self.cell_px = cell_px or max(1, math.ceil(roll_width_px / 512))
+        self.width_cells = roll_width_px // self.cell_px
+        self.gap_cells = math.ceil(gap_px / self.cell_px)
+        self.max_length_px = max_length_px
+        self.allow_rotation = allow_rotation
+        self.pieces = []
+        self.rolls = []
+        self._work_dir = tempfile.mkdtemp(prefix='marker_', dir=work_dir)
+
+    def _cells(self, mask):
+        """把全分辨率蒙版按网格最大池化（有任一像素即占用），保证全分辨率下不重叠"""
+        c = self.cell_px
+        h, w = mask.shape
+        padded = np.zeros((math.ceil(h / c) * c, math.ceil(w / c) * c), dtype=bool)
+        padded[:h, :w] = mask
+        return padded.reshape(padded.shape[0] // c, c, padded.shape[1] // c, c).any(axis=(1, 3))
+
+    def _dilated(self, cells):
+        """按间距外扩（四周各扩 gap 格），用于标记占用"""
+        g = self.gap_cells
+        if g == 0:
+            return cells.astype(np.float32)
+        padded = np.pad(cells.astype(np.uint8), g)
+        kernel = np.ones((2 * g + 1, 2 * g + 1), dtype=np.uint8)
+        return cv2.dilate(padded, kernel).astype(np.float32)
+
+    def add_piece(self, piece_id, image_bgra):
+        """
+        加入一个裁片（BGRA），裁掉透明边后落盘
+        """
+        opaque = image_bgra[..., 3] > 0
+        rows = np.flatnonzero(opaque.any(axis=1))
+        cols = np.flatnonzero(opaque.any(axis=0))
+        if rows.size == 0:
+            return
+        r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        crop = image_bgra[r0:r1, c0:c1]
+        mask = opaque[r0:r1, c0:c1]
+
+        path = os.path.join(self._work_dir, f"{len(self.pieces):05d}.npy")
+        np.save(path, crop)
+
+        orientations = {False: self._cells(mask)}
+        if self.allow_rotation:
+            orientations[True] = self._cells(mask[::-1, ::-1])
+        self.pieces.append({
+            'id': piece_id,
+            'path': path,
+            'size': (crop.shape[1], crop.shape[0]),
+            'area': int(np.count_nonzero(mask)),
+            'cells': {rotated: (cells.astype(np.float32), self._dilated(cells))
+                      for rotated, cells in orientations.items()},
+        })
+
+    def _find_position(self, occ, used_rows, col_heights, back_rows, piece):
+        """在当前卷上找最低、最靠左的无碰撞位置，返回 (y, x, 是否旋转) 或 None"""
+        best = None
+        max_rows = self.max_length_px // self.cell_px if self.max_length_px else None
+        floor = max(0, int(col_heights.min()) - back_rows)
+        for rotated, (cells, _) in piece['cells'].items():
+            h, w = cells.shape
+            if w > self.width_cells:
+                continue
+            # 已放裁片下方还有 gap 行被标记为占用，窗口要越过这些行才能在下方找到位置
+            window = occ[floor:used_rows + self.gap_cells + h]
+            # 一次互相关得到所有位置的重叠量，0 即无碰撞
+            overlap = cv2.matchTemplate(window, cells, cv2.TM_CCORR)
+            for y, x in np.argwhere(overlap < 0.5):
+                y += floor
+                if max_rows is not None and y + h > max_rows:
+                    break
+                if best is not None and (y, x) >= best[:2]:
+                    break
+                # DFT 互相关有浮点误差，逐个精确复核
+                if not np.any(occ[y:y + h, x:x + w] * cells):
+                    best = (y, x, rotated)
+                    break
+        return best
+
+    def pack(self):
+        """
+        排料（大裁片优先，自下而左），结果保存在 self.rolls
+        :return: 报告字典（卷数、每卷长度和利用率、排料耗时）
+        """
+        start = time.perf_counter()
+        self.rolls = []
+        back_rows = max((p['cells'][False][0].shape[0] for p in self.pieces), default=0) * 2
+
+        occ = None
+        for piece in sorted(self.pieces, key=lambda p: -p['area']):
+            if piece['cells'][False][0].shape[1] > self.width_cells and \
+                    (not self.allow_rotation or piece['cells'][True][0].shape[1] > self.width_cells):
+                raise ValueError(f"裁片 {piece['id']} 宽度超过卷料幅宽")
+            while True:
+                if occ is None:
+                    occ = np.zeros((1024, self.width_cells), dtype=np.float32)
+                    col_heights = np.zeros(self.width_cells, dtype=np.int64)
+                    used_rows = 0
+                    roll = {'placements': []}
+                    self.rolls.append(roll)
+
+                h = piece['cells'][False][0].shape[0]
+                if occ.shape[0] < used_rows + h + self.gap_cells:
+                    grown = np.zeros((max(occ.shape[0] * 2, used_rows + h + self.gap_cells), self.width_cells),
+                                     dtype=np.float32)
+                    grown[:occ.shape[0]] = occ
+                    occ = grown
+
+                position = self._find_position(occ, used_rows, col_heights, back_rows, piece)
+                if position is not None:
+                    break
+                if not roll['placements']:
+                    raise ValueError(f"裁片 {piece['id']} 长度超过单卷最大长度")
+                occ = None  # 当前卷已满，换新卷
+
+            y, x, rotated = position
+            cells, dilated = piece['cells'][rotated]
+            h, w = cells.shape
+            g = self.gap_cells
+            y0, x0 = max(0, y - g), max(0, x - g)
+            y1, x1 = y + h + g, min(self.width_cells, x + w + g)
+            region = occ[y0:y1, x0:x1]
+            np.maximum(region, dilated[y0 - (y - g):y0 - (y - g) + region.shape[0],
+                                       x0 - (x - g):x0 - (x - g) + region.shape[1]], out=region)
+            col_heights[x:x + w] = np.maximum(col_heights[x:x + w], y + h)
+            used_rows = max(used_rows, y + h)
+            roll['placements'].append({'piece': piece, 'x': int(x) * self.cell_px, 'y': int(y) * self.cell_px,
+                                       'rotated': rotated})
+
+        pack_seconds = time.perf_counter() - start
+        report = {'pack_seconds': pack_seconds, 'rolls': []}
+        for roll in self.rolls:
+            length = int(max(p['y'] + p['piece']['size'][1] for p in roll['placements']))
+            roll['length_px'] = length
+            area = sum(p['piece']['area'] for p in roll['placements'])
+            report['rolls'].append({
+                'pieces': len(roll['placements']),
+                'length_px': length,
+                'utilization': float(area / (self.roll_width_px * length)),
+            })
+        return report
+
+    def write(self, output_dir, prefix='marker', dpi=None, strip_rows=1024, icc_profile=None, compress_level=6):
+        """
+        按条带流式写出每卷的PNG（白底RGB），内存只占一条带加正在使用的裁片映射
+        :param icc_profile: 嵌入的ICC描述文件（字节）
+        :param compress_level: PNG压缩级别
+        :return: 输出文件路径列表
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        paths = []
+        for index, roll in enumerate(self.rolls, start=1):
+            path = os.path.join(output_dir, f"{prefix}_{index:02d}.png")
+            placements = sorted(roll['placements'], key=lambda p: p['y'])
+            with PNGStreamWriter(path, self.roll_width_px, roll['length_px'], dpi=dpi,
+                                 compress_level=compress_level, icc_profile=icc_profile) as writer:
+                for strip_y in range(0, roll['length_px'], strip_rows):
+                    strip_h = min(strip_rows, roll['length_px'] - strip_y)
+                    strip = np.full((strip_h, self.roll_width_px, 3), 255, dtype=np.uint8)
+                    for p in placements:
+                        if p['y'] >= strip_y + strip_h:
+                            break
+                        self._blend_into_strip(strip, strip_y, p)
+                    writer.write_rows(strip)
+            paths.append(path)
+        return paths
+
+    def _blend_into_strip(self, strip, strip_y, placement):
+        """把裁片与条带重叠的部分按alpha合成到白底上"""
+        w, h = placement['piece']['size']
+        top = max(placement['y'], strip_y)
+        bottom = min(placement['y'] + h, strip_y + strip.shape[0])
+        if top >= bottom:
+            return
+        piece = np.load(placement['piece']['path'], mmap_mode='r')
+        if placement['rotated']:
+            piece = piece[::-1, ::-1]
+        rows = piece[top - placement['y']:bottom - placement['y']]
+        alpha = rows[..., 3:4].astype(np.uint16)
+        rgb = rows[..., 2::-1].astype(np.uint16)  # BGR -> RGB
+        target = strip[top - strip_y:bottom - strip_y, placement['x']:placement['x'] + w]
+        blended = (rgb * alpha + target.astype(np.uint16) * (255 - alpha) + 127) // 255
+        target[...] = blended.astype(np.uint8)
+
+    def close(self):
+        """删除裁片临时文件"""
+        shutil.rmtree(self._work_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
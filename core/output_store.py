@@ -0,0 +1,137 @@
+# core/output_store.py - 内容寻址的输出缓存
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+
+# 渲染逻辑变化时递增，使旧缓存全部失效
+STORE_VERSION = 1
+
+DEFAULT_STORE_DIR = os.path.join('data', 'output_store')
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+
+
+def _reflink(src, dst):
+    """尝试写时复制克隆（Linux FICLONE），不支持时返回False"""
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    FICLONE = 0x40049409
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+class OutputStore:
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        按输入内容哈希缓存渲染结果，超出容量时按最近使用时间淘汰
+        :param store_dir: 缓存目录
+        :param max_bytes: 缓存容量上限（字节）
+        """
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self._file_hashes = {}  # (路径, 大小, mtime) -> 内容哈希
+        os.makedirs(store_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    def file_digest(self, path):
+        """计算文件内容哈希，同一会话内按 (大小, mtime) 复用"""
+        st = os.stat(path)
+        memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        digest = self._file_hashes.get(memo_key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            self._file_hashes[memo_key] = digest
+        return digest
+
+    def make_key(self, template_psd_path, pattern_paths, template_config, options=None):
+        """
+        生成缓存键
+        :param pattern_paths: 参与渲染的印花文件路径（不存在的文件记为None）
+        :param template_config: 模板配置（只取影响输出的字段）
+        :param options: 其它渲染选项
+        """
+        filename = os.path.basename(template_psd_path)
+        payload = {
+            'version': STORE_VERSION,
+            'filename': filename,
+            'psd': self.file_digest(template_psd_path),
+            'patterns': [self.file_digest(p) if p and os.path.exists(p) else None
+                         for p in pattern_paths],
+            'layer_names': list(template_config['layer_names']),
+            'rotations': sorted(layer for psd_name, layer in template_config['rotation_rules']
+                                if psd_name == filename),
+            'position_rules': template_config['position_rules'],
+            'fill_rules': template_config.get('fill_rules', {}),
+            'options': options or {},
+        }
+        encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def _path_for(self, key):
+        return os.path.join(self.store_dir, key[:2], f"{key}.png")
+
+    def _entries(self):
+        """遍历缓存条目 (路径, 大小, mtime)"""
+        for root, _, files in os.walk(self.store_dir):
+            for name in files:
+                if name.endswith('.png'):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def _materialize(self, src, dst):
+        """把 src 放到 dst：优先reflink，否则复制（不用硬链接，就地修改输出不会改坏缓存条目）"""
+        if os.path.exists(dst):
+            os.remove(dst)
+        if not _reflink(src, dst):
+            shutil.copyfile(src, dst)
+
+    def fetch(self, key, output_path):
+        """命中时把缓存结果放到 output_path 并返回True"""
+        path = self._path_for(key)
+        if not os.path.exists(path):
+            return False
+        os.utime(path)  # 更新最近使用时间
+        self._materialize(path, output_path)
+        return True
+
+    def put(self, key, output_path):
+        """把新渲染的输出加入缓存，必要时淘汰最久未使用的条目"""
+        path = self._path_for(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        self._materialize(output_path, tmp_path)
+        os.replace(tmp_path, path)
+        self.total_bytes += os.path.getsize(path)
+        self.evict()
+
+    def evict(self):
+        """按LRU淘汰，直到缓存不超过容量上限"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        for path, size, _ in sorted(self._entries(), key=lambda entry: entry[2]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.total_bytes -= size
+            except OSError:
+                pass
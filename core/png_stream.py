@@ -0,0 +1,78 @@
+# core/png_stream.py - 逐行流式写出超长PNG（不需要整幅图像驻留内存）
+
+import zlib
+import struct
+import numpy as np
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class PNGStreamWriter:
+    def __init__(self, path, width, height, dpi=None, compress_level=6, icc_profile=None):
+        """
+        流式PNG写入器（RGB，8位）
+        :param width: 图像宽度
+        :param height: 图像总高度（写完时必须正好写满）
+        :param dpi: 写入pHYs物理尺寸信息，供RIP识别
+        :param icc_profile: 写入iCCP色彩描述文件（字节）
+        """
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._file = open(path, 'wb')
+        self._compressor = zlib.compressobj(compress_level)
+
+        self._file.write(_PNG_SIGNATURE)
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        if icc_profile:
+            self._write_chunk(b'iCCP', b'ICC Profile\x00\x00' + zlib.compress(icc_profile))
+        if dpi:
+            pixels_per_meter = round(dpi / 0.0254)
+            self._write_chunk(b'pHYs', struct.pack('>IIB', pixels_per_meter, pixels_per_meter, 1))
+
+    def _write_chunk(self, chunk_type, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    def write_rows(self, rows):
+        """写入若干行，rows 为 (n, width, 3) 的uint8 RGB数组"""
+        n = rows.shape[0]
+        if rows.shape[1:] != (self.width, 3):
+            raise ValueError(f"行尺寸不匹配: {rows.shape}")
+        if self.rows_written + n > self.height:
+            raise ValueError("写入行数超过图像高度")
+
+        # Sub 过滤器：每个字节减去左侧像素对应字节
+        flat = rows.reshape(n, -1)
+        filtered = np.empty((n, flat.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 1
+        filtered[:, 1:4] = flat[:, :3]
+        np.subtract(flat[:, 3:], flat[:, :-3], out=filtered[:, 4:])
+
+        data = self._compressor.compress(filtered.tobytes())
+        if data:
+            self._write_chunk(b'IDAT', data)
+        self.rows_written += n
+
+    def close(self):
+        """结束写入"""
+        if self._file.closed:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"只写入了 {self.rows_written}/{self.height} 行")
+            self._write_chunk(b'IDAT', self._compressor.flush())
+            self._write_chunk(b'IEND', b'')
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
@@ -0,0 +1,261 @@
+# core/preflight.py - 预检：只解析PSD文件头和图层记录（不读取像素数据）
+
+import os
+import time
+import struct
+
+# PSB 中使用8字节长度的附加图层信息键
+_PSB_LONG_KEYS = {b'LMsk', b'Lr16', b'Lr32', b'Layr', b'Mt16', b'Mt32', b'Mtrn',
+                  b'Alph', b'FMsk', b'lnk2', b'FEid', b'FXid', b'PxSD'}
+_SIGNATURES = (b'8BIM', b'8B64')
+
+
+class PSDHeaderError(ValueError):
+    """PSD文件头或图层记录无法解析"""
+
+
+class _Reader:
+    def __init__(self, f, version):
+        self.f = f
+        self.version = version
+
+    def read(self, size):
+        data = self.f.read(size)
+        if len(data) != size:
+            raise PSDHeaderError("文件意外结束")
+        return data
+
+    def unpack(self, fmt):
+        return struct.unpack('>' + fmt, self.read(struct.calcsize('>' + fmt)))
+
+    def length(self):
+        """读取段长度：PSD为4字节，PSB为8字节"""
+        return self.unpack('Q' if self.version == 2 else 'I')[0]
+
+    def skip_section(self):
+        """跳过以4字节长度开头的数据段"""
+        size = self.unpack('I')[0]
+        self.f.seek(size, os.SEEK_CUR)
+
+    def tell(self):
+        return self.f.tell()
+
+    def seek(self, offset):
+        self.f.seek(offset)
+
+
+def _layer_kind(blocks):
+    if b'TySh' in blocks:
+        return 'type'
+    if b'SoLd' in blocks or b'PlLd' in blocks or b'SoLE' in blocks:
+        return 'smartobject'
+    if b'vscg' in blocks or b'SoCo' in blocks or b'GdFl' in blocks or b'PtFl' in blocks:
+        return 'shape'
+    return 'pixel'
+
+
+def _read_layer_record(r):
+    top, left, bottom, right = r.unpack('iiii')
+    channel_count = r.unpack('H')[0]
+    for _ in range(channel_count):
+        r.unpack('h')
+        r.length()
+    signature = r.read(4)
+    if signature != b'8BIM':
+        raise PSDHeaderError("图层混合模式签名错误")
+    blend_mode = r.read(4)
+    opacity, clipping, flags, _ = r.unpack('BBBB')
+    extra_length = r.unpack('I')[0]
+    extra_end = r.tell() + extra_length
+
+    # 图层蒙版数据、混合范围
+    r.skip_section()
+    r.skip_section()
+
+    # Pascal 图层名，按4字节对齐
+    name_length = r.unpack('B')[0]
+    name = r.read(name_length).decode('macroman', 'replace')
+    r.seek(r.tell() + (3 - name_length % 4))
+
+    # 附加图层信息（只取名称和分组信息）
+    blocks = set()
+    section_type = 0
+    while r.tell() + 12 <= extra_end:
+        signature = r.read(4)
+        if signature not in _SIGNATURES:
+            # 部分文件按偶数或4字节补齐，向后找下一个签名
+            r.seek(r.tell() - 3)
+            continue
+        key = r.read(4)
+        size = r.unpack('Q')[0] if (r.version == 2 and key in _PSB_LONG_KEYS) else r.unpack('I')[0]
+        data_start = r.tell()
+        blocks.add(key)
+        if key == b'luni':
+            char_count = r.unpack('I')[0]
+            name = r.read(char_count * 2).decode('utf-16-be', 'replace').rstrip('\x00')
+        elif key in (b'lsct', b'lsdr'):
+            section_type = r.unpack('I')[0]
+        r.seek(data_start + size)
+    r.seek(extra_end)
+
+    return {
+        'name': name,
+        'left': left,
+        'top': top,
+        'width': max(right - left, 0),
+        'height': max(bottom - top, 0),
+        'visible': not (flags & 0x02),
+        'opacity': opacity,
+        'clipping': bool(clipping),
+        'blend_mode': blend_mode.decode('ascii', 'replace'),
+        'section_type': section_type,
+        'kind': 'group' if section_type in (1, 2) else _layer_kind(blocks),
+    }
+
+
+def read_psd_layers(psd_path):
+    """
+    只读取文件头和图层记录，跳过所有通道像素数据
+    :return: {'width', 'height', 'depth', 'version', 'layers': [图层字典]}，
+             图层按 find_all_renderable_layers 的口径标记 renderable 和 parent 路径
+    """
+    with open(psd_path, 'rb') as f:
+        if f.read(4) != b'8BPS':
+            raise PSDHeaderError("不是PSD/PSB文件")
+        version = struct.unpack('>H', f.read(2))[0]
+        if version not in (1, 2):
+            raise PSDHeaderError(f"不支持的PSD版本: {version}")
+        r = _Reader(f, version)
+        r.read(6)
+        _, height, width, depth, _ = r.unpack('HIIHH')
+
+        # 颜色模式数据、图像资源
+        r.skip_section()
+        r.skip_section()
+
+        # 图层与蒙版信息段 -> 图层信息段
+        records = []
+        if r.length() > 0:
+            if r.length() > 0:
+                # 图层数为负表示第一个alpha通道为合并结果的透明度
+                layer_count = abs(r.unpack('h')[0])
+                records = [_read_layer_record(r) for _ in range(layer_count)]
+
+    # 按记录顺序（自底向上）重建分组：分隔符(3)开始一组，组记录(1/2)结束一组
+    stack = [[]]
+    for record in records:
+        if record['section_type'] == 3:
+            stack.append([])
+        elif record['section_type'] in (1, 2):
+            children = stack.pop() if len(stack) > 1 else []
+            record['children'] = children
+            stack[-1].append(record)
+        else:
+            stack[-1].append(record)
+
+    layers = []
+
+    def walk(nodes, parent_visible, path):
+        for node in nodes:
+            visible = parent_visible and node['visible']
+            if 'children' in node:
+                walk(node['children'], visible, path + [node['name']])
+                continue
+            node['group_path'] = '/'.join(path)
+            node['renderable'] = visible and node['width'] > 0 and node['height'] > 0
+            layers.append(node)
+
+    walk(stack[0], True, [])
+    return {'width': width, 'height': height, 'depth': depth, 'version': version, 'layers': layers}
+
+
+def parse_size_label(filename):
+    """从文件名解析尺码标签（与处理流程一致：取最后一个'-'之后的部分），无分隔符返回None"""
+    base_name = os.path.splitext(filename)[0]
+    return base_name.split('-')[-1] if '-' in base_name else None
+
+
+class PreflightScanner:
+    def __init__(self, template_config):
+        """
+        预检扫描器
+        :param template_config: 模板配置字典
+        """
+        self.config = template_config
+
+    def scan_file(self, psd_path):
+        """预检单个PSD文件"""
+        filename = os.path.basename(psd_path)
+        start = time.perf_counter()
+        result = {'filename': filename, 'size_label': parse_size_label(filename)}
+        try:
+            info = read_psd_layers(psd_path)
+        except (OSError, ValueError, struct.error) as e:
+            result.update(error=str(e), elapsed=time.perf_counter() - start)
+            return result
+
+        renderable = [layer['name'] for layer in info['layers'] if layer['renderable']]
+        result.update(
+            canvas=(info['width'], info['height']),
+            depth=info['depth'],
+            layers=info['layers'],
+            present=[name for name in self.config['layer_names'] if renderable.count(name) == 1],
+            duplicated=[name for name in self.config['layer_names'] if renderable.count(name) > 1],
+            missing=[name for name in self.config['layer_names'] if name not in renderable],
+            elapsed=time.perf_counter() - start,
+        )
+        return result
+
+    def scan_directory(self, template_dir, pattern_dir=None):
+        """
+        预检目录中所有PSD文件
+        :return: {'files': [单文件结果], 'dangling_rotation_rules': [...], 'missing_patterns': [...]}
+        """
+        psd_files = sorted(f for f in os.listdir(template_dir) if f.lower().endswith('.psd'))
+        files = [self.scan_file(os.path.join(template_dir, f)) for f in psd_files]
+        by_name = {result['filename']: result for result in files}
+
+        dangling = []
+        for psd_name, layer_name in self.config['rotation_rules']:
+            result = by_name.get(psd_name)
+            if result is None:
+                dangling.append((psd_name, layer_name, "PSD文件不存在"))
+            elif 'error' not in result and layer_name not in result['present'] + result['duplicated']:
+                dangling.append((psd_name, layer_name, "图层不存在"))
+
+        missing_patterns = []
+        if pattern_dir is not None:
+            missing_patterns = [f for f in self.config['pattern_files']
+                                if not os.path.exists(os.path.join(pattern_dir, f))]
+
+        return {'files': files, 'dangling_rotation_rules': dangling, 'missing_patterns': missing_patterns}
+
+
+def has_problems(report):
+    """预检报告中是否存在问题"""
+    return bool(report['dangling_rotation_rules'] or report['missing_patterns'] or
+                any('error' in r or r['missing'] or r['duplicated'] or r['size_label'] is None
+                    for r in report['files']))
+
+
+def format_report(report):
+    """把预检报告格式化为日志行"""
+    lines = []
+    for r in report['files']:
+        if 'error' in r:
+            lines.append(f"❌ {r['filename']}: 无法解析 ({r['error']})")
+            continue
+        width, height = r['canvas']
+        status = "✅" if not (r['missing'] or r['duplicated'] or r['size_label'] is None) else "⚠️"
+        lines.append(f"{status} {r['filename']}: {width}x{height}, 尺码 {r['size_label'] or '无法解析'}, "
+                     f"图层 {len(r['present'])}/{len(r['present']) + len(r['missing']) + len(r['duplicated'])}"
+                     f" ({r['elapsed'] * 1000:.0f} ms)")
+        if r['missing']:
+            lines.append(f"    缺少图层: {', '.join(r['missing'])}")
+        if r['duplicated']:
+            lines.append(f"    重复图层: {', '.join(r['duplicated'])}")
+    for psd_name, layer_name, reason in report['dangling_rotation_rules']:
+        lines.append(f"⚠️ 旋转规则无效: ({psd_name}, {layer_name}) - {reason}")
+    if report['missing_patterns']:
+        lines.append(f"⚠️ 缺少印花文件: {', '.join(report['missing_patterns'])}")
+    return lines
@@ -1,25 +1,87 @@
 # core/processor.py - PSD处理核心
 
 import os
+import time
+import tracemalloc
 import cv2
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 from psd_tools import PSDImage
+from core.shared_inputs import SharedInputs, SharedInputsView, MaskLayer
+from core.psd_masks import read_layer_alpha
+from core.fill import fill_pattern, pattern_target_size, mm_to_px
+from core.nesting import MarkerNester
+from core.isolation import SupervisedPool, FAILURE_KINDS, TemplateParseError, MemoryBudgetExceeded, classify_error
+from core.tuning import load_tuning, system_memory
 
 class PSDProcessor:
-    def __init__(self, template_config, log_callback=None):
+    def __init__(self, template_config, log_callback=None, output_store=None, memory_budget_mb=None,
+                 color_manager=None, staging_cache=None, tuning=None, measure_decode_savings=False):
         """
         初始化PSD处理器
         :param template_config: 模板配置字典
         :param log_callback: 日志回调函数
+        :param output_store: 输出缓存(OutputStore)，相同输入直接复用已有结果
+        :param memory_budget_mb: 单文件内存预算(MB)，设置后提前释放PSD数据并用tracemalloc记录每个文件的内存峰值；
+                                 峰值超出预算的文件中止并记为失败，并行进程数按可用内存/预算封顶
+        :param color_manager: 色彩管理(ColorManager)，设置后印花在缩放前转换到打印机ICC，输出嵌入该ICC
+        :param staging_cache: 本地暂存(StagingCache)，网络共享上的模板和印花先预取到本机再打开
+        :param tuning: 调优配置(TuningProfile)，默认读取本机的 data/tuning.json（没有则为默认值）
+        :param measure_decode_savings: 缩小解码时另做一次完整解码计时（每个印花一次），记录节省的解码时间；
+                                       会额外花费完整解码的时间和内存，只用于评估
         """
         self.config = template_config
         self.log_callback = log_callback or print
+        self.output_store = output_store
+        self.memory_budget_mb = memory_budget_mb
+        self.color_manager = color_manager
+        self.staging_cache = staging_cache
+        self.tuning = tuning if tuning is not None else load_tuning()
+        self.tuning.apply_threads()
+        self.last_error = None  # 最近一次处理失败的异常（隔离模式据此分类）
+        self.failures = {}  # 隔离模式下失败的文件名 -> 失败类型
+        self.memory_peaks = {}  # 文件名 -> 内存峰值(字节)
+        # tracemalloc 看不到 Pillow 的像素内存，按图像尺寸补记：画布常驻，其它取最大的一张
+        self.pillow_resident_bytes = 0
+        self.pillow_transient_bytes = 0
+        self.pattern_stats = []  # 缩小解码的印花统计
+        self.measure_decode_savings = measure_decode_savings
+        self._full_decode_seconds = {}  # 印花路径 -> 完整解码耗时
+        
+        # 快速查找表：(PSD文件名, 图层名) 集合与每个图层的标签位置
+        self.rotation_set = template_config.get('rotation_set') or \
+            frozenset(tuple(rule) for rule in template_config['rotation_rules'])
+        self.label_positions = template_config.get('label_positions') or \
+            {name: template_config['position_rules'].get(name) for name in template_config['layer_names']}
+        self.fill_rules = template_config.get('fill_rules', {})
         
     def log(self, message):
         """记录日志"""
         self.log_callback(message)
     
+    def local_path(self, path):
+        """打开输入文件时使用的路径：启用本地暂存时为本地副本"""
+        if self.staging_cache is None or not os.path.exists(path):
+            return path
+        return self.staging_cache.local_path(path)
+    
+    def prefetch_inputs(self, template_paths, pattern_dir):
+        """按处理顺序在后台预取本批次的输入：所有尺码共用的印花在前，模板按处理顺序在后"""
+        if self.staging_cache is None:
+            return
+        pattern_paths = [os.path.join(pattern_dir, f) for f in dict.fromkeys(self.config['pattern_files'])]
+        self.staging_cache.prefetch([p for p in pattern_paths if os.path.exists(p)] + list(template_paths))
+    
+    def log_staging_stats(self):
+        """输出本地暂存统计"""
+        if self.staging_cache is None:
+            return
+        stats = self.staging_cache.stats
+        rate = stats['copied_bytes'] / stats['copy_seconds'] / 1024 ** 2 if stats['copy_seconds'] else 0
+        self.log(f"本地暂存: 复制 {stats['copies']} 个文件 {stats['copied_bytes'] / 1024 ** 2:.1f} MB "
+                 f"({rate:.0f} MB/s), 命中 {stats['hits']} 个")
+    
     def find_all_renderable_layers(self, layer_source, found_layers):
         """递归查找所有可渲染的图层"""
         for layer in layer_source:
@@ -29,11 +91,99 @@ class PSDProcessor:
                 if layer.is_visible() and layer.width > 0 and layer.height > 0:
                     found_layers.append(layer)
     
-    def apply_pattern_to_layer(self, layer, pattern_image, rotate=False):
-        """将印花应用到图层"""
-        layer_pil = layer.composite()
+    def detach_layer_masks(self, all_layers):
+        """提取配置中各目标图层的蒙版，返回 [MaskLayer]，之后可释放PSD对象"""
+        detached = []
+        for target_name in self.config['layer_names']:
+            found_layer = next((layer for layer in all_layers if layer.name == target_name), None)
+            if found_layer is None:
+                continue
+            alpha = self.extract_layer_alpha(found_layer)
+            if alpha is not None:
+                detached.append(MaskLayer(target_name, found_layer.left, found_layer.top, alpha))
+        return detached
+    
+    def note_pillow_image(self, image, resident=False):
+        """补记一张 Pillow 图像的像素内存（仅内存预算模式统计峰值时使用）"""
+        nbytes = image.width * image.height * len(image.getbands())
+        if resident:
+            self.pillow_resident_bytes += nbytes
+        else:
+            self.pillow_transient_bytes = max(self.pillow_transient_bytes, nbytes)
+    
+    def load_pattern(self, pattern_path, target_size=None):
+        """
+        加载印花图案
+        :param target_size: 印花最终需要的 (宽, 高)；给定时JPEG在DCT域按 1/2、1/4、1/8
+                            缩小解码到不小于该尺寸的最小比例
+        :return: (PIL RGB图像, 是否缩小解码)
+        """
+        start = time.perf_counter()
+        pattern_image = Image.open(self.local_path(pattern_path))
+        full_size = pattern_image.size
+        if target_size:
+            pattern_image.draft("RGB", target_size)
+        pattern_image = pattern_image.convert("RGB")
+        self.note_pillow_image(pattern_image)
+        
+        reduced = pattern_image.size != full_size
+        if reduced:
+            decode_seconds = time.perf_counter() - start
+            saved_bytes = (full_size[0] * full_size[1] - pattern_image.width * pattern_image.height) * 3
+            stats = {
+                'file': os.path.basename(pattern_path),
+                'full_size': full_size,
+                'decoded_size': pattern_image.size,
+                'decode_seconds': decode_seconds,
+                'saved_bytes': saved_bytes,
+            }
+            timing = f"耗时 {decode_seconds * 1000:.0f} ms"
+            if self.measure_decode_savings:
+                full_seconds = self.full_decode_seconds(pattern_path)
+                stats.update(full_decode_seconds=full_seconds, saved_seconds=full_seconds - decode_seconds)
+                timing += f"（完整解码 {full_seconds * 1000:.0f} ms, 节省 {(full_seconds - decode_seconds) * 1000:.0f} ms）"
+            self.pattern_stats.append(stats)
+            self.log(f"印花 {os.path.basename(pattern_path)}: {full_size[0]}x{full_size[1]} -> "
+                     f"缩小解码 {pattern_image.width}x{pattern_image.height}, "
+                     f"{timing}, 节省内存 {saved_bytes / 1024 ** 2:.1f} MB")
+        return pattern_image, reduced
+    
+    def draft_size(self, pattern_path, target_size):
+        """load_pattern 按该目标尺寸解码出的尺寸（只读文件头，不解码像素）"""
+        with Image.open(self.local_path(pattern_path)) as image:
+            if target_size:
+                image.draft("RGB", target_size)
+            return image.size
+    
+    def full_decode_seconds(self, pattern_path):
+        """不缩小时完整解码该印花的耗时（同一印花只测一次）"""
+        if pattern_path not in self._full_decode_seconds:
+            start = time.perf_counter()
+            with Image.open(self.local_path(pattern_path)) as image:
+                image.convert("RGB")
+            self._full_decode_seconds[pattern_path] = time.perf_counter() - start
+        return self._full_decode_seconds[pattern_path]
+    
+    def extract_layer_alpha(self, layer):
+        """提取图层的alpha通道(uint8)，失败返回None"""
+        if isinstance(layer, MaskLayer):
+            return layer.alpha
+        
+        # 普通像素图层直接解码透明通道，其余（效果、剪贴、蒙版等）走完整合成
+        alpha = read_layer_alpha(layer)
+        if alpha is not None:
+            return alpha
+        
+        try:
+            layer_pil = layer.composite()
+        except (MemoryError, OSError):
+            raise
+        except Exception as e:
+            # 通道数据损坏等只有在解码图层时才会暴露
+            raise TemplateParseError(f"图层 {layer.name} 无法解码: {e}") from e
         if layer_pil is None:
             return None
+        self.note_pillow_image(layer_pil)
             
         layer_cv = cv2.cvtColor(np.array(layer_pil), cv2.COLOR_RGBA2BGRA)
         
@@ -41,27 +191,56 @@ class PSDProcessor:
             _, _, _, alpha = cv2.split(layer_cv)
         except ValueError:
             return None
+        return alpha
+    
+    def apply_pattern_to_layer(self, layer, pattern_image, rotate=False, scale=1.0,
+                               interpolation=cv2.INTER_LINEAR, convert_color=False, icc_profile=None):
+        """
+        将印花应用到图层，scale<1时使用缩小的蒙版
+        :param pattern_image: PIL RGB图像，或已解码的BGR数组（共享内存视图）
+        :param interpolation: 印花缩放插值方式
+        :param convert_color: 填充后在裁片上做色彩转换（印花比裁片大时）
+        :param icc_profile: 印花内嵌的ICC，在裁片上做色彩转换时作为源色彩空间
+        填充方式由模板的 fill_rules 决定：stretch(拉伸，默认) / fit(等比填满) / tile(平铺)
+        """
+        alpha = self.extract_layer_alpha(layer)
+        if alpha is None:
+            return None
             
+        if scale != 1.0:
+            h, w = alpha.shape
+            alpha = cv2.resize(alpha, (max(1, round(w * scale)), max(1, round(h * scale))),
+                               interpolation=cv2.INTER_AREA)
+        
         _, mask = cv2.threshold(alpha, 10, 255, cv2.THRESH_BINARY)
-        pattern_cv = cv2.cvtColor(np.array(pattern_image), cv2.COLOR_RGB2BGR)
+        if isinstance(pattern_image, np.ndarray):
+            pattern_cv = pattern_image
+        else:
+            pattern_cv = cv2.cvtColor(np.array(pattern_image), cv2.COLOR_RGB2BGR)
         
         h, w = mask.shape
-        resized_pattern = cv2.resize(pattern_cv, (w, h))
+        resized_pattern = fill_pattern(pattern_cv, (w, h), self.fill_rules.get(layer.name),
+                                       scale=scale, interpolation=interpolation)
+        if convert_color:
+            self.color_manager.convert_array(resized_pattern, icc_profile)
         
         if rotate:
             resized_pattern = cv2.rotate(resized_pattern, cv2.ROTATE_180)
             
-        final_piece = cv2.bitwise_and(resized_pattern, resized_pattern, mask=mask)
-        b, g, r = cv2.split(final_piece)
+        # 就地清除蒙版外的像素，避免再分配整片大小的中间结果
+        resized_pattern[mask == 0] = 0
         
-        return cv2.merge([b, g, r, mask])
+        return np.dstack((resized_pattern, mask))
     
-    def add_label_to_piece(self, image_to_label, label_text, position, rotate=False):
-        """添加标签到图片"""
+    def label_metrics(self, scale=1.0):
+        """按缩放比例返回标签的 (字号, 主线宽, 描边线宽, 边距)"""
+        return (1.2 * scale, max(1, round(2 * scale)),
+                max(1, round(12 * scale)), round(30 * scale))
+    
+    def add_label_to_piece(self, image_to_label, label_text, position, rotate=False, scale=1.0):
+        """添加标签到图片（就地修改，只转换标签覆盖的区域）"""
         font = cv2.FONT_HERSHEY_SIMPLEX
-        font_scale = 1.2
-        main_thickness = 2
-        outline_thickness = 12
+        font_scale, main_thickness, outline_thickness, _ = self.label_metrics(scale)
         main_color_bgra = (0, 0, 255, 255)  # 红色
         outline_color_bgra = (255, 255, 255, 255)  # 白色描边
         
@@ -80,21 +259,29 @@ class PSDProcessor:
         if rotate:
             text_canvas = cv2.flip(text_canvas, -1)
             
-        main_image_pil = Image.fromarray(cv2.cvtColor(image_to_label, cv2.COLOR_BGRA2RGBA))
+        img_h, img_w = image_to_label.shape[:2]
+        x, y = position
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(img_w, x + canvas_w), min(img_h, y + canvas_h)
+        if x0 >= x1 or y0 >= y1:
+            return image_to_label
+        
+        region = image_to_label[y0:y1, x0:x1]
+        region_pil = Image.fromarray(cv2.cvtColor(region, cv2.COLOR_BGRA2RGBA))
         text_pil = Image.fromarray(cv2.cvtColor(text_canvas, cv2.COLOR_BGRA2RGBA))
-        main_image_pil.paste(text_pil, position, text_pil)
+        region_pil.paste(text_pil, (x - x0, y - y0), text_pil)
+        region[...] = cv2.cvtColor(np.array(region_pil), cv2.COLOR_RGBA2BGRA)
         
-        return cv2.cvtColor(np.array(main_image_pil), cv2.COLOR_RGBA2BGRA)
+        return image_to_label
     
-    def calculate_label_position(self, img_shape, layer_name, size_label, should_rotate):
+    def calculate_label_position(self, img_shape, layer_name, size_label, should_rotate, scale=1.0):
         """计算标签位置"""
         img_h, img_w, _ = img_shape
-        font_scale, thickness = 1.2, 2
+        font_scale, thickness, _, padding = self.label_metrics(scale)
         (text_w, text_h), baseline = cv2.getTextSize(size_label, cv2.FONT_HERSHEY_SIMPLEX, 
                                                     font_scale, thickness)
-        padding = 30
         
-        position_key = self.config['position_rules'].get(layer_name)
+        position_key = self.label_positions.get(layer_name)
         
         if position_key == 'top_left':
             return (padding, padding)
@@ -105,89 +292,424 @@ class PSDProcessor:
         else:
             return ((img_w - text_w) // 2, img_h - text_h - baseline - padding)
     
-    def process_single_template(self, template_psd_path, pattern_folder_path, output_dir):
-        """处理单个PSD模板文件"""
+    def open_template(self, template_psd_path):
+        """打开模板，返回 ((宽, 高), 可渲染图层列表)"""
+        filename = os.path.basename(template_psd_path)
+        
+        # 打开PSD文件，获取所有可渲染图层
+        # 文件读不到、磁盘错误等原样抛出（OSError），只有解析失败标记为模板损坏
         try:
-            filename = os.path.basename(template_psd_path)
-            self.log(f"开始处理: {filename}")
-            
-            # 提取尺码标签
-            base_name = os.path.splitext(filename)[0]
-            try:
-                size_label = base_name.split('-')[-1]
-            except IndexError:
-                size_label = "N/A"
-            
-            # 打开PSD文件
-            psd = PSDImage.open(template_psd_path)
-            
-            # 创建白色背景画布
-            final_canvas = Image.new('RGBA', (psd.width, psd.height), (255, 255, 255, 255))
-            
-            # 获取所有可渲染图层
+            psd = PSDImage.open(self.local_path(template_psd_path))
             all_layers = []
             self.find_all_renderable_layers(psd, all_layers)
             
-            if not all_layers:
-                self.log(f"警告: 在 {filename} 中未找到可用图层")
-                return False
-            
-            # 处理每个配置的图层
-            layer_names = self.config['layer_names']
-            pattern_files = self.config['pattern_files']
-            rotation_rules = self.config['rotation_rules']
-            
-            for target_name, pattern_filename in zip(layer_names, pattern_files):
-                # 检查印花文件是否存在
-                full_pattern_path = os.path.join(pattern_folder_path, pattern_filename)
-                if not os.path.exists(full_pattern_path):
-                    self.log(f"警告: 印花文件 {pattern_filename} 不存在，跳过图层 {target_name}")
-                    continue
+            if self.memory_budget_mb is not None and all_layers:
+                # 内存预算模式：蒙版提取完即释放PSD通道数据和图层对象
+                all_layers = self.detach_layer_masks(all_layers)
+        except (MemoryError, OSError, TemplateParseError):
+            raise
+        except Exception as e:
+            raise TemplateParseError(f"无法解析 {filename}: {e}") from e
+        return (psd.width, psd.height), all_layers
+    
+    def iter_pieces(self, filename, all_layers, pattern_folder_path, scale=1.0, shared=None):
+        """
+        逐个生成印好花、加好标签的裁片
+        :return: 迭代 (图层名, BGRA裁片, 在模板画布上的位置(x, y))
+        """
+        # 提取尺码标签
+        base_name = os.path.splitext(filename)[0]
+        try:
+            size_label = base_name.split('-')[-1]
+        except IndexError:
+            size_label = "N/A"
+        
+        # 处理每个配置的图层
+        layer_names = self.config['layer_names']
+        pattern_files = self.config['pattern_files']
+        
+        for target_name, pattern_filename in zip(layer_names, pattern_files):
+            # 检查印花文件是否存在
+            full_pattern_path = os.path.join(pattern_folder_path, pattern_filename)
+            if not os.path.exists(full_pattern_path):
+                self.log(f"警告: 印花文件 {pattern_filename} 不存在，跳过图层 {target_name}")
+                continue
+            
+            # 查找对应图层
+            found_layer = next((layer for layer in all_layers if layer.name == target_name), None)
+            
+            if found_layer:
+                # 加载印花图案：已知裁片尺寸，超大JPEG直接缩小解码
+                piece_size = (max(1, round(found_layer.width * scale)),
+                              max(1, round(found_layer.height * scale)))
+                target_size = pattern_target_size(self.fill_rules.get(target_name), piece_size, scale)
+                # 共享印花按目标尺寸查找，与单进程解码出的尺寸相同
+                shared_pattern = shared.pattern(full_pattern_path, target_size) if shared is not None else None
+                if shared_pattern is not None:
+                    pattern_image, reduced, icc_profile = shared_pattern
+                    pattern_pixels = pattern_image.shape[0] * pattern_image.shape[1]
+                else:
+                    pattern_image, reduced = self.load_pattern(full_pattern_path, target_size)
+                    icc_profile = pattern_image.info.get('icc_profile')
+                    pattern_pixels = pattern_image.width * pattern_image.height
+                convert_piece = False
+                if self.color_manager is not None:
+                    # 色彩转换放在像素更少的一侧：缩放前的印花，或填充后的裁片
+                    # （共享印花未转换且只读，按同一规则转换其副本，结果与单进程相同）
+                    if pattern_pixels > piece_size[0] * piece_size[1]:
+                        convert_piece = True
+                    elif shared_pattern is not None:
+                        pattern_image = self.color_manager.convert_array(pattern_image.copy(), icc_profile)
+                    else:
+                        self.color_manager.convert(pattern_image)
+                # 缩小解码后再用区域插值完成高质量缩放；未缩小的保持原有插值
+                interpolation = cv2.INTER_AREA if reduced else cv2.INTER_LINEAR
                 
-                # 查找对应图层
-                found_layer = next((layer for layer in all_layers if layer.name == target_name), None)
+                # 检查是否需要旋转
+                should_rotate = (filename, found_layer.name) in self.rotation_set
                 
-                if found_layer:
-                    # 加载印花图案
-                    pattern_image = Image.open(full_pattern_path).convert("RGB")
-                    
-                    # 检查是否需要旋转
-                    should_rotate = (filename, found_layer.name) in rotation_rules
-                    
-                    self.log(f"处理图层 {target_name} -> {pattern_filename} (旋转: {should_rotate})")
+                self.log(f"处理图层 {target_name} -> {pattern_filename} (旋转: {should_rotate})")
+                
+                # 应用印花
+                processed_image_cv = self.apply_pattern_to_layer(found_layer, pattern_image,
+                                                                 rotate=should_rotate, scale=scale,
+                                                                 interpolation=interpolation,
+                                                                 convert_color=convert_piece,
+                                                                 icc_profile=icc_profile)
+                del pattern_image
+                
+                if processed_image_cv is not None:
+                    # 计算标签位置
+                    label_pos = self.calculate_label_position(processed_image_cv.shape, 
+                                                            found_layer.name, size_label, should_rotate,
+                                                            scale=scale)
                     
-                    # 应用印花
-                    processed_image_cv = self.apply_pattern_to_layer(found_layer, pattern_image, rotate=should_rotate)
+                    # 添加标签
+                    image_with_label = self.add_label_to_piece(processed_image_cv, size_label, 
+                                                             label_pos, rotate=should_rotate, scale=scale)
                     
-                    if processed_image_cv is not None:
-                        # 计算标签位置
-                        label_pos = self.calculate_label_position(processed_image_cv.shape, 
-                                                                found_layer.name, size_label, should_rotate)
-                        
-                        # 添加标签
-                        image_with_label = self.add_label_to_piece(processed_image_cv, size_label, 
-                                                                 label_pos, rotate=should_rotate)
-                        
-                        # 合并到最终画布
-                        processed_image_pil = Image.fromarray(cv2.cvtColor(image_with_label, cv2.COLOR_BGRA2RGBA))
-                        final_canvas.paste(processed_image_pil, (found_layer.left, found_layer.top), processed_image_pil)
-                else:
-                    self.log(f"警告: 图层 {target_name} 在 {filename} 中未找到")
+                    yield target_name, image_with_label, (round(found_layer.left * scale),
+                                                          round(found_layer.top * scale))
+                    del image_with_label
+                
+                # 粘贴完成后立即释放本裁片的中间结果
+                del processed_image_cv
+            else:
+                self.log(f"警告: 图层 {target_name} 在 {filename} 中未找到")
+    
+    def render_template(self, template_psd_path, pattern_folder_path, scale=1.0, shared=None):
+        """
+        渲染单个PSD模板，正式输出与预览共用此流程
+        :param scale: 缩放比例，1.0为原始分辨率，小于1时生成低分辨率预览
+        :param shared: 共享输入视图(SharedInputsView)，有则直接读取已解码的印花
+        :return: 渲染后的画布(PIL RGBA)，没有可用图层时返回None
+        """
+        filename = os.path.basename(template_psd_path)
+        (psd_width, psd_height), all_layers = self.open_template(template_psd_path)
+        
+        # 创建白色背景画布
+        canvas_size = (max(1, round(psd_width * scale)), max(1, round(psd_height * scale)))
+        final_canvas = Image.new('RGBA', canvas_size, (255, 255, 255, 255))
+        self.note_pillow_image(final_canvas, resident=True)
+        self.check_memory_budget(filename)
+        
+        if not all_layers:
+            self.log(f"警告: 在 {filename} 中未找到可用图层")
+            return None
+        
+        for _, image_with_label, paste_pos in self.iter_pieces(filename, all_layers, pattern_folder_path,
+                                                               scale=scale, shared=shared):
+            # 合并到最终画布
+            processed_image_pil = Image.fromarray(cv2.cvtColor(image_with_label, cv2.COLOR_BGRA2RGBA))
+            final_canvas.paste(processed_image_pil, paste_pos, processed_image_pil)
+            del image_with_label, processed_image_pil
+            self.check_memory_budget(filename)
+        
+        return final_canvas
+    
+    def process_single_template(self, template_psd_path, pattern_folder_path, output_dir, shared=None):
+        """处理单个PSD模板文件"""
+        self.last_error = None
+        try:
+            filename = os.path.basename(template_psd_path)
+            self.log(f"开始处理: {filename}")
             
-            # 保存最终结果
             output_path_name = os.path.splitext(filename)[0]
             final_output_path = os.path.join(output_dir, f"{output_path_name}.png")
-            final_canvas.save(final_output_path)
+            
+            # 相同输入直接复用缓存结果
+            store_key = None
+            if self.output_store is not None:
+                # 本地副本保留原文件名，哈希本地副本即可，不必再从网络读取
+                pattern_paths = [self.local_path(os.path.join(pattern_folder_path, f))
+                                 for f in self.config['pattern_files']]
+                options = {'color': self.color_manager.key} if self.color_manager is not None else None
+                store_key = self.output_store.make_key(self.local_path(template_psd_path), pattern_paths,
+                                                       self.config, options)
+                if self.output_store.fetch(store_key, final_output_path):
+                    self.log(f"♻️ {filename} 命中输出缓存 -> {final_output_path}")
+                    return True
+            
+            tracing = self.memory_budget_mb is not None
+            if tracing:
+                started_tracing = not tracemalloc.is_tracing()
+                if started_tracing:
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+                self.pillow_resident_bytes = self.pillow_transient_bytes = 0
+            
+            try:
+                final_canvas = self.render_template(template_psd_path, pattern_folder_path, shared=shared)
+                if final_canvas is None:
+                    return False
+                
+                # 保存最终结果：写临时文件再替换，
+                # 多个节点同时写同一输出（租约被回收后原节点仍在处理）时也只会留下完整文件
+                tmp_output_path = f"{final_output_path}.{os.getpid()}.tmp"
+                save_options = {'compress_level': self.tuning.compress_level}
+                if self.color_manager is not None:
+                    save_options['icc_profile'] = self.color_manager.printer_profile_bytes
+                try:
+                    final_canvas.save(tmp_output_path, format='PNG', **save_options)
+                    os.replace(tmp_output_path, final_output_path)
+                except BaseException:
+                    # 磁盘满、无权限等写出失败时不留下半成品临时文件
+                    if os.path.exists(tmp_output_path):
+                        os.remove(tmp_output_path)
+                    raise
+                del final_canvas
+            finally:
+                if tracing:
+                    self.record_memory_peak(filename)
+                    if started_tracing:
+                        tracemalloc.stop()
+            
+            if store_key is not None:
+                self.output_store.put(store_key, final_output_path)
             
             self.log(f"✅ {filename} 处理完成 -> {final_output_path}")
             return True
             
         except Exception as e:
+            self.last_error = e
             self.log(f"❌ 处理 {filename} 时发生错误: {str(e)}")
             return False
     
-    def process_directory(self, template_dir, pattern_dir, output_dir):
-        """批量处理目录中的所有PSD文件"""
+    def current_memory_peak(self):
+        """
+        当前文件到目前为止的内存峰值（字节）
+        峰值 = tracemalloc 统计的NumPy/Python分配 + Pillow图像（画布整个处理期间常驻，另加最大的一张印花/图层合成图）
+        """
+        _, traced_peak = tracemalloc.get_traced_memory()
+        return traced_peak + self.pillow_resident_bytes + self.pillow_transient_bytes
+    
+    def check_memory_budget(self, filename):
+        """内存预算模式下峰值已超出预算时中止当前文件（不写出输出）"""
+        if self.memory_budget_mb is None or not tracemalloc.is_tracing():
+            return
+        peak_mb = self.current_memory_peak() / 1024 ** 2
+        if peak_mb > self.memory_budget_mb:
+            raise MemoryBudgetExceeded(f"{filename} 内存峰值 {peak_mb:.1f} MB 超出预算 {self.memory_budget_mb} MB")
+    
+    def workers_within_budget(self, workers):
+        """内存预算模式下并行进程数不超过 可用内存 / 单文件预算"""
+        if self.memory_budget_mb is None or workers <= 1:
+            return workers
+        memory = system_memory()
+        if memory is None:
+            return workers
+        limit = max(1, int(memory[1] / 1024 ** 2 // self.memory_budget_mb))
+        if limit < workers:
+            self.log(f"可用内存 {memory[1] / 1024 ** 2:.0f} MB, 单文件预算 {self.memory_budget_mb} MB: "
+                     f"并行进程数 {workers} -> {limit}")
+            return limit
+        return workers
+    
+    def record_memory_peak(self, filename):
+        """记录当前文件的内存峰值并与预算比较"""
+        peak = self.current_memory_peak()
+        self.memory_peaks[filename] = peak
+        peak_mb = peak / 1024 ** 2
+        if peak_mb > self.memory_budget_mb:
+            self.log(f"⚠️ {filename} 内存峰值 {peak_mb:.1f} MB 超出预算 {self.memory_budget_mb} MB")
+        else:
+            self.log(f"{filename} 内存峰值 {peak_mb:.1f} MB (预算 {self.memory_budget_mb} MB)")
+    
+    def render_previews(self, template_dir, pattern_dir, scale=0.1):
+        """
+        生成目录中所有PSD模板的低分辨率预览
+        :param scale: 预览缩放比例
+        :return: [(文件名, 预览图PIL)] 列表，按文件名排序
+        """
+        psd_files = sorted(f for f in os.listdir(template_dir) if f.lower().endswith('.psd'))
+        
+        if not psd_files:
+            self.log("错误: 模板目录中未找到PSD文件")
+            return []
+        
+        self.prefetch_inputs([os.path.join(template_dir, f) for f in psd_files], pattern_dir)
+        previews = []
+        for filename in psd_files:
+            start = time.perf_counter()
+            try:
+                preview = self.render_template(os.path.join(template_dir, filename), pattern_dir, scale=scale)
+            except Exception as e:
+                self.log(f"❌ 预览 {filename} 时发生错误: {str(e)}")
+                continue
+            
+            if preview is not None:
+                previews.append((filename, preview))
+                self.log(f"预览 {filename}: {preview.width}x{preview.height}, "
+                         f"耗时 {time.perf_counter() - start:.2f}s")
+        
+        return previews
+    
+    def build_markers(self, jobs, output_dir, roll_width_mm, dpi, gap_mm=5, max_length_mm=None):
+        """
+        排料：把多个尺码/订单的裁片排到固定幅宽的卷料上，每卷输出一张长图
+        :param jobs: [(PSD模板路径, 印花目录)]，可包含多个订单
+        :param roll_width_mm: 卷料幅宽(mm)
+        :param dpi: 模板的打印分辨率
+        :param gap_mm: 裁片间距(mm)
+        :param max_length_mm: 单卷最大长度(mm)，None 为不限
+        :return: (输出文件列表, 排料报告)
+        """
+        max_length_px = mm_to_px(max_length_mm, dpi) if max_length_mm else None
+        # mm_to_px 至少为1像素，间距为0时不能用它换算
+        gap_px = mm_to_px(gap_mm, dpi) if gap_mm > 0 else 0
+        with MarkerNester(mm_to_px(roll_width_mm, dpi), gap_px=gap_px,
+                          max_length_px=max_length_px) as nester:
+            for template_path, pattern_dir in jobs:
+                filename = os.path.basename(template_path)
+                try:
+                    _, all_layers = self.open_template(template_path)
+                    if not all_layers:
+                        self.log(f"警告: 在 {filename} 中未找到可用图层")
+                        continue
+                    job_name = os.path.basename(os.path.normpath(pattern_dir))
+                    for layer_name, image_with_label, _ in self.iter_pieces(filename, all_layers, pattern_dir):
+                        nester.add_piece(f"{job_name}/{os.path.splitext(filename)[0]}/{layer_name}",
+                                         image_with_label)
+                except Exception as e:
+                    self.log(f"❌ 处理 {filename} 时发生错误: {str(e)}")
+            
+            self.log(f"开始排料: {len(nester.pieces)} 个裁片, 幅宽 {roll_width_mm} mm")
+            report = nester.pack()
+            icc_profile = self.color_manager.printer_profile_bytes if self.color_manager is not None else None
+            paths = nester.write(output_dir, dpi=dpi, icc_profile=icc_profile,
+                                 strip_rows=self.tuning.strip_rows, compress_level=self.tuning.compress_level)
+        
+        for path, roll in zip(paths, report['rolls']):
+            self.log(f"✅ {os.path.basename(path)}: {roll['pieces']} 个裁片, "
+                     f"长度 {roll['length_px'] / dpi * 25.4 / 1000:.2f} m, 利用率 {roll['utilization']:.1%}")
+        self.log(f"排料耗时 {report['pack_seconds']:.2f}s")
+        return paths, report
+    
+    def publish_batch_inputs(self, template_paths, pattern_dir, shared):
+        """把本批次的印花解码一次并写入共享内存（蒙版各由处理该模板的子进程提取）"""
+        # 只读图层尺寸（不解码图层），得到每个印花在各尺码中的目标尺寸
+        target_sizes = {}
+        for template_path in template_paths:
+            filename = os.path.basename(template_path)
+            try:
+                psd = PSDImage.open(self.local_path(template_path))
+                all_layers = []
+                self.find_all_renderable_layers(psd, all_layers)
+                for target_name, pattern_filename in zip(self.config['layer_names'], self.config['pattern_files']):
+                    layer = next((layer for layer in all_layers if layer.name == target_name), None)
+                    if layer is None:
+                        continue
+                    # 与 iter_pieces 相同：平铺图层按平铺单元尺寸，其余按裁片尺寸
+                    target_sizes.setdefault(pattern_filename, set()).add(
+                        pattern_target_size(self.fill_rules.get(target_name), (layer.width, layer.height)))
+            except Exception as e:
+                # 子进程打开该模板时报告错误
+                self.log(f"读取 {filename} 图层尺寸失败: {str(e)}")
+        
+        for pattern_filename in dict.fromkeys(self.config['pattern_files']):
+            full_pattern_path = os.path.join(pattern_dir, pattern_filename)
+            if not os.path.exists(full_pattern_path):
+                continue
+            # 目标尺寸跨过JPEG缩小比例（1/2、1/4、1/8）时解码尺寸不同，每种解码尺寸各解码一次
+            by_decoded_size = {}
+            for target_size in target_sizes.get(pattern_filename, ()):
+                by_decoded_size.setdefault(self.draft_size(full_pattern_path, target_size), []).append(target_size)
+            for targets in by_decoded_size.values():
+                # 色彩转换留给子进程：与单进程按同一规则选择在印花还是裁片上转换
+                pattern_image, reduced = self.load_pattern(full_pattern_path, targets[0])
+                shared.publish_pattern(full_pattern_path,
+                                       cv2.cvtColor(np.array(pattern_image), cv2.COLOR_RGB2BGR),
+                                       targets, reduced=reduced, icc_profile=pattern_image.info.get('icc_profile'))
+        
+        self.log(f"共享输入已就绪: {shared.nbytes / 1024 ** 2:.1f} MB")
+    
+    def process_directory_parallel(self, template_paths, pattern_dir, output_dir, workers):
+        """多进程处理，印花经共享内存只保存一份，蒙版由各子进程并行提取"""
+        success_count = 0
+        with SharedInputs() as shared:
+            self.publish_batch_inputs(template_paths, pattern_dir, shared)
+            descriptor = shared.descriptor()
+            
+            tuning = self.tuning.for_workers(workers)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = []
+                for template_path in template_paths:
+                    shared.acquire()
+                    future = executor.submit(_process_with_shared_inputs, self.config, self.output_store,
+                                             self.memory_budget_mb, self.color_manager, self.staging_cache,
+                                             tuning, descriptor,
+                                             template_path, pattern_dir, output_dir)
+                    future.add_done_callback(lambda _: shared.release())
+                    futures.append(future)
+                
+                for future in futures:
+                    try:
+                        ok, messages = future.result()
+                    except Exception as e:
+                        ok, messages = False, [f"❌ 子进程异常: {str(e)}"]
+                    for message in messages:
+                        self.log(message)
+                    if ok:
+                        success_count += 1
+        return success_count
+    
+    def process_directory_isolated(self, template_paths, pattern_dir, output_dir, workers, isolation):
+        """
+        隔离模式：每个模板在受监控的子进程中处理，超时或超内存只影响该文件
+        :param isolation: IsolationPolicy
+        """
+        options = {'output_store': self.output_store, 'memory_budget_mb': self.memory_budget_mb,
+                   'color_manager': self.color_manager, 'staging_cache': self.staging_cache,
+                   'tuning': self.tuning.for_workers(workers)}
+        pool = SupervisedPool(_isolated_worker_main, (self.config, options), isolation,
+                              workers=workers, log_callback=self.log)
+        self.failures = {}
+        
+        def on_result(task, result):
+            filename = os.path.basename(task[0])
+            for message in result['messages']:
+                self.log(message)
+            if not result['ok']:
+                self.failures[filename] = result['kind']
+                if result['kind'] in ('timeout', 'oom', 'crash'):
+                    self.log(f"❌ {filename} {FAILURE_KINDS[result['kind']]}: {result.get('error')}"
+                             f"（共尝试 {result['attempts']} 次）")
+        
+        results = pool.run([(path, pattern_dir, output_dir) for path in template_paths],
+                           task_name=lambda task: os.path.basename(task[0]), on_result=on_result)
+        if self.failures:
+            counts = {}
+            for kind in self.failures.values():
+                counts[kind] = counts.get(kind, 0) + 1
+            self.log("失败分类: " + ", ".join(f"{FAILURE_KINDS[kind]} {count}" for kind, count in counts.items()))
+        return sum(1 for _, result in results if result['ok'])
+    
+    def process_directory(self, template_dir, pattern_dir, output_dir, workers=1, isolation=None):
+        """
+        批量处理目录中的所有PSD文件
+        :param workers: 进程数，大于1时多进程处理并共享解码后的输入
+        :param isolation: 隔离策略(IsolationPolicy)，设置后每个文件在独立子进程中处理（限制耗时和内存）
+        """
         try:
             # 创建输出目录
             os.makedirs(output_dir, exist_ok=True)
@@ -201,16 +723,60 @@ class PSDProcessor:
             
             self.log(f"找到 {len(psd_files)} 个PSD文件")
             
-            # 处理每个文件
-            success_count = 0
-            for filename in psd_files:
-                template_path = os.path.join(template_dir, filename)
-                if self.process_single_template(template_path, pattern_dir, output_dir):
-                    success_count += 1
+            # 处理每个文件（启用本地暂存时后台预取，处理第一个文件时其余文件继续复制）
+            template_paths = [os.path.join(template_dir, filename) for filename in psd_files]
+            self.prefetch_inputs(template_paths, pattern_dir)
+            workers = self.workers_within_budget(workers)
+            if isolation is not None:
+                success_count = self.process_directory_isolated(
+                    template_paths, pattern_dir, output_dir, workers, isolation)
+            elif workers > 1 and len(template_paths) > 1:
+                success_count = self.process_directory_parallel(
+                    template_paths, pattern_dir, output_dir, min(workers, len(template_paths)))
+            else:
+                success_count = 0
+                for template_path in template_paths:
+                    if self.process_single_template(template_path, pattern_dir, output_dir):
+                        success_count += 1
             
+            self.log_staging_stats()
             self.log(f"批量处理完成: 成功 {success_count}/{len(psd_files)}")
             return success_count, len(psd_files)
             
         except Exception as e:
             self.log(f"批量处理失败: {str(e)}")
-            return 0, 0
\ No newline at end of file
+            return 0, 0
+
+
+def _process_with_shared_inputs(template_config, output_store, memory_budget_mb, color_manager, staging_cache,
+                                tuning, descriptor, template_path, pattern_dir, output_dir):
+    """子进程入口：从共享内存读取输入并处理单个模板，返回 (是否成功, 日志列表)"""
+    messages = []
+    processor = PSDProcessor(template_config, messages.append, output_store=output_store,
+                             memory_budget_mb=memory_budget_mb, color_manager=color_manager,
+                             staging_cache=staging_cache, tuning=tuning)
+    shared = SharedInputsView(descriptor)
+    try:
+        ok = processor.process_single_template(template_path, pattern_dir, output_dir, shared=shared)
+    finally:
+        shared.close()
+    return ok, messages
+
+
+def _isolated_worker_main(conn, template_config, options):
+    """隔离模式子进程入口：循环接收 (模板路径, 印花目录, 输出目录)，逐个处理并回报结果"""
+    messages = []
+    processor = PSDProcessor(template_config, messages.append, **options)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        messages.clear()
+        ok = processor.process_single_template(*task)
+        error = processor.last_error
+        conn.send({'ok': ok, 'messages': list(messages),
+                   'kind': None if ok else classify_error(error),
+                   'error': str(error) if error is not None else None})
@@ -0,0 +1,51 @@
+# core/psd_masks.py - 直接读取图层透明通道（跳过完整的RGBA合成）
+
+import numpy as np
+from psd_tools.constants import BlendMode, ChannelID, Tag
+
+
+def can_read_alpha_directly(layer):
+    """
+    判断图层的透明通道是否与 composite() 结果的alpha等价
+    只有普通像素图层（正常混合、不透明度100%、无效果/剪贴/蒙版）才满足
+    """
+    if layer.kind != 'pixel':
+        return False
+    if layer.has_effects() or layer.has_mask() or layer.has_vector_mask():
+        return False
+    if layer.clip_layers or layer.clipping:
+        return False
+    if layer.opacity != 255 or layer.blend_mode != BlendMode.NORMAL:
+        return False
+    if layer.tagged_blocks is not None and \
+            layer.tagged_blocks.get_data(Tag.BLEND_FILL_OPACITY, 255) != 255:
+        return False
+    record = layer._record
+    return layer.bbox == (record.left, record.top, record.right, record.bottom)
+
+
+def read_layer_alpha(layer):
+    """
+    从通道记录中只解码透明通道(RLE/ZIP)，返回uint8数组
+    不满足等价条件或读取失败时返回None，调用方应回退到 composite()
+    """
+    try:
+        if not can_read_alpha_directly(layer):
+            return None
+
+        psd = layer._psd
+        if psd.depth != 8:
+            return None
+
+        record = layer._record
+        index = next((i for i, info in enumerate(record.channel_info)
+                      if info.id == ChannelID.TRANSPARENCY_MASK), None)
+        if index is None:
+            return None
+
+        width, height = record.right - record.left, record.bottom - record.top
+        data = layer._channels[index].get_data(width, height, psd.depth, psd.version)
+        alpha = np.frombuffer(data, dtype=np.uint8, count=width * height).reshape(height, width)
+        return alpha.copy()  # frombuffer 结果只读，复制为可写数组
+    except Exception:
+        return None
@@ -0,0 +1,441 @@
+# core/regression.py - 金样图回归检查：各渲染方式的输出与金样逐像素比对，同时记录吞吐
+
+import io
+import os
+import json
+import time
+import shutil
+import contextlib
+import cv2
+import numpy as np
+from PIL import Image
+from core.processor import PSDProcessor
+from core.output_store import OutputStore
+
+SYNTHETIC_SIZES = (('M', 1.0), ('XL', 1.2), ('2XL', 1.3))
+
+
+# ---------- 测试语料 ----------
+
+def _piece_shape(w, h, kind):
+    """生成带软边的裁片形状（RGBA），kind 0 为椭圆，1 为带领口缺口的圆角矩形"""
+    piece = np.zeros((h, w, 4), dtype=np.uint8)
+    piece[..., :3] = 200
+    alpha = np.zeros((h, w), dtype=np.uint8)
+    if kind == 0:
+        cv2.ellipse(alpha, (w // 2, h // 2), (max(1, w // 2 - 3), max(1, h // 2 - 3)), 0, 0, 360, 255, -1)
+    else:
+        r = max(2, min(w, h) // 8)
+        cv2.rectangle(alpha, (r, 3), (w - r - 1, h - 4), 255, -1)
+        cv2.rectangle(alpha, (3, r), (w - 4, h - r - 1), 255, -1)
+        cv2.ellipse(alpha, (w // 2, 0), (max(1, w // 5), max(1, h // 8)), 0, 0, 180, 0, -1)
+    piece[..., 3] = cv2.GaussianBlur(alpha, (7, 7), 0)
+    return Image.fromarray(piece, 'RGBA')
+
+
+def _strip_user_mask(layer):
+    """
+    去掉图层的用户蒙版通道（部分 psd-tools 版本的 PixelLayer.frompil 总会加上），
+    使合成语料的图层走直接读取透明通道的快速路径，与真实模板中的普通像素图层一致
+    """
+    from psd_tools.constants import ChannelID
+    record = layer._record
+    keep = [i for i, info in enumerate(record.channel_info) if info.id != ChannelID.USER_LAYER_MASK]
+    record.channel_info = [record.channel_info[i] for i in keep]
+    layer._channels[:] = [layer._channels[i] for i in keep]
+    record.mask_data = None
+
+
+def _synthetic_pattern(width, height, label, rng):
+    """生成带标记文字的平滑随机印花（RGB）"""
+    noise = rng.integers(0, 256, (max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8)
+    pattern = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    cv2.putText(pattern, label, (width // 5, height * 2 // 3), cv2.FONT_HERSHEY_SIMPLEX,
+                max(1.0, width / 80), (0, 0, 255), max(2, width // 60))
+    return Image.fromarray(pattern)
+
+
+def template_filenames(template_config, sizes=SYNTHETIC_SIZES):
+    """语料中的PSD文件名：优先使用旋转规则里出现的文件名，使旋转规则也被覆盖"""
+    names = sorted({psd_name for psd_name, _ in template_config['rotation_rules']})
+    if names:
+        return names
+    return [f"模板-{size}.psd" for size, _ in sizes]
+
+
+def build_synthetic_case(case_dir, template_key, template_config, pattern_size=(2500, 3000),
+                         base_size=(1600, 1200), seed=1, fill_rules=None, size_step=0.15):
+    """
+    生成一组合成语料：每个尺码一个PSD（图层按模板配置命名），以及配置中的全部印花
+    :param pattern_size: 印花 (宽, 高)；大于裁片时覆盖缩小解码路径，小于裁片时覆盖放大路径
+    :param size_step: 相邻尺码的放大比例；足够大时各尺码的裁片落在不同的JPEG缩小比例上
+    :param fill_rules: 写入 case.json 的填充规则，渲染时覆盖模板配置中的同名图层规则
+    """
+    from psd_tools import PSDImage
+    from psd_tools.api.layers import PixelLayer
+
+    templates_dir = os.path.join(case_dir, 'templates')
+    patterns_dir = os.path.join(case_dir, 'patterns')
+    os.makedirs(templates_dir, exist_ok=True)
+    os.makedirs(patterns_dir, exist_ok=True)
+
+    layer_names = template_config['layer_names']
+    columns = max(1, int(np.ceil(np.sqrt(len(layer_names)))))
+    rows = int(np.ceil(len(layer_names) / columns))
+    for index, filename in enumerate(template_filenames(template_config)):
+        k = 1.0 + size_step * index  # 尺码越大裁片越大
+        width, height = int(base_size[0] * k), int(base_size[1] * k)
+        cell_w, cell_h = width // columns, height // rows
+        psd = PSDImage.new('RGBA', (width, height))
+        for i, name in enumerate(layer_names):
+            w, h = int(cell_w * 0.8), int(cell_h * 0.8)
+            left = (i % columns) * cell_w + (cell_w - w) // 2
+            top = (i // columns) * cell_h + (cell_h - h) // 2
+            # psd-tools 保存非ASCII名称时需先建图层再改名（写入Unicode名称）
+            layer = PixelLayer.frompil(_piece_shape(w, h, i % 2), psd, 'layer', top, left)
+            _strip_user_mask(layer)
+            psd.append(layer)
+            layer.name = name
+        psd.save(os.path.join(templates_dir, filename))
+
+    rng = np.random.default_rng(seed)
+    for pattern_filename in dict.fromkeys(template_config['pattern_files']):
+        label = os.path.splitext(pattern_filename)[0]
+        _synthetic_pattern(*pattern_size, label, rng).save(os.path.join(patterns_dir, pattern_filename), quality=92)
+
+    info = {'template': template_key, 'synthetic': True, 'pattern_size': list(pattern_size)}
+    if fill_rules:
+        info['fill_rules'] = fill_rules
+    with open(os.path.join(case_dir, 'case.json'), 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+
+
+def build_synthetic_corpus(corpus_dir, template_configs):
+    """
+    为每个模板生成四组语料：大印花（缩小解码路径）、小印花（放大路径），
+    平铺单元大于裁片的平铺图层（缩小解码目标按平铺单元而不是裁片），
+    以及尺码间裁片相差一倍、同一印花按不同缩小比例解码的一组（多进程共享印花须按尺码区分解码尺寸）
+    :param template_configs: {模板键: 模板配置}
+    """
+    for template_key, template_config in template_configs.items():
+        build_synthetic_case(os.path.join(corpus_dir, f"{template_key}-large"), template_key, template_config,
+                             pattern_size=(2500, 3000))
+        build_synthetic_case(os.path.join(corpus_dir, f"{template_key}-small"), template_key, template_config,
+                             pattern_size=(320, 400))
+        tile_layer = template_config['layer_names'][-1]
+        build_synthetic_case(os.path.join(corpus_dir, f"{template_key}-tile"), template_key, template_config,
+                             pattern_size=(2500, 3000),
+                             fill_rules={tile_layer: {'mode': 'tile', 'repeat_mm': 200, 'dpi': 300}})
+        build_synthetic_case(os.path.join(corpus_dir, f"{template_key}-draft"), template_key, template_config,
+                             pattern_size=(2500, 3000), size_step=1.0)
+
+
+def list_cases(corpus_dir):
+    """
+    语料目录下的用例：每个子目录包含 templates/、patterns/ 和可选的 case.json（{"template": 模板键}）
+    真实样例按同样结构放入即可
+    """
+    cases = []
+    for name in sorted(os.listdir(corpus_dir)):
+        case_dir = os.path.join(corpus_dir, name)
+        if os.path.isdir(os.path.join(case_dir, 'templates')) and os.path.isdir(os.path.join(case_dir, 'patterns')):
+            case_file = os.path.join(case_dir, 'case.json')
+            info = {}
+            if os.path.exists(case_file):
+                with open(case_file, 'r', encoding='utf-8') as f:
+                    info = json.load(f)
+            cases.append((name, case_dir, info))
+    return cases
+
+
+# ---------- 渲染方式 ----------
+
+def _render_serial(template_config, templates_dir, patterns_dir, output_dir, work_dir):
+    return PSDProcessor(template_config, lambda message: None).process_directory(
+        templates_dir, patterns_dir, output_dir)
+
+
+def _render_parallel(template_config, templates_dir, patterns_dir, output_dir, work_dir):
+    return PSDProcessor(template_config, lambda message: None).process_directory(
+        templates_dir, patterns_dir, output_dir, workers=2)
+
+
+def _render_memory_budget(template_config, templates_dir, patterns_dir, output_dir, work_dir):
+    return PSDProcessor(template_config, lambda message: None, memory_budget_mb=4096).process_directory(
+        templates_dir, patterns_dir, output_dir)
+
+
+def _render_output_store(template_config, templates_dir, patterns_dir, output_dir, work_dir):
+    """先渲染一遍填充缓存，再从缓存取出输出（比对的是缓存命中的结果）"""
+    store = OutputStore(os.path.join(work_dir, 'output_store'))
+    warm_dir = os.path.join(work_dir, 'output_store_warm')
+    PSDProcessor(template_config, lambda message: None, output_store=store).process_directory(
+        templates_dir, patterns_dir, warm_dir)
+    return PSDProcessor(template_config, lambda message: None, output_store=store).process_directory(
+        templates_dir, patterns_dir, output_dir)
+
+
+def _render_legacy(template_config, templates_dir, patterns_dir, output_dir, work_dir):
+    """原始脚本 men_tshirt.py 的流程（完整合成图层、全尺寸解码印花）"""
+    import men_tshirt
+    men_tshirt.PATTERN_FOLDER_PATH = patterns_dir
+    men_tshirt.output_dir = output_dir
+    men_tshirt.TARGET_LAYER_NAMES = list(template_config['layer_names'])
+    men_tshirt.PATTERN_FILENAMES = list(template_config['pattern_files'])
+    men_tshirt.ROTATION_RULES = [tuple(rule) for rule in template_config['rotation_rules']]
+    men_tshirt.POSITION_RULES = dict(template_config['position_rules'])
+    psd_files = sorted(f for f in os.listdir(templates_dir) if f.lower().endswith('.psd'))
+    success_count = 0
+    for filename in psd_files:
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                men_tshirt.process_single_template(os.path.join(templates_dir, filename))
+            success_count += 1
+        except Exception:
+            pass
+    return success_count, len(psd_files)
+
+
+# 渲染方式 -> 函数(模板配置, 模板目录, 印花目录, 输出目录, 临时目录) -> (成功数, 总数)
+RENDER_MODES = {
+    'serial': _render_serial,
+    'parallel': _render_parallel,
+    'memory_budget': _render_memory_budget,
+    'output_store': _render_output_store,
+    'legacy': _render_legacy,
+}
+
+
+# ---------- 比对 ----------
+
+class Tolerance:
+    def __init__(self, max_abs=0, max_fraction=0.0):
+        """
+        比对容差
+        :param max_abs: 单个像素任一通道允许的最大差值
+        :param max_fraction: 超出 max_abs 的像素允许占的比例
+        """
+        self.max_abs = max_abs
+        self.max_fraction = max_fraction
+
+    def __repr__(self):
+        return f"max_abs={self.max_abs}, max_fraction={self.max_fraction:g}"
+
+
+def compare_images(golden_path, output_path, tolerance, heatmap_path=None):
+    """
+    逐像素比对两张PNG（RGBA）
+    :param heatmap_path: 有差异时写出差异热图（金样灰度底图上叠加差值伪彩色）
+    :return: 比对结果字典
+    """
+    golden = np.asarray(Image.open(golden_path).convert('RGBA'))
+    output = np.asarray(Image.open(output_path).convert('RGBA'))
+    if golden.shape != output.shape:
+        return {'passed': False, 'reason': f"尺寸不一致: {golden.shape[1]}x{golden.shape[0]} vs "
+                                           f"{output.shape[1]}x{output.shape[0]}"}
+
+    diff = cv2.absdiff(golden, output).max(axis=2)
+    max_diff = int(diff.max())
+    bad_fraction = float(np.count_nonzero(diff > tolerance.max_abs)) / diff.size
+    result = {
+        'passed': bad_fraction <= tolerance.max_fraction,
+        'max_diff': max_diff,
+        'mean_diff': float(diff.mean()),
+        'changed_fraction': float(np.count_nonzero(diff)) / diff.size,
+        'bad_fraction': bad_fraction,
+    }
+
+    if heatmap_path and max_diff > 0:
+        gray = cv2.cvtColor(cv2.cvtColor(golden, cv2.COLOR_RGBA2RGB), cv2.COLOR_RGB2GRAY)
+        base = cv2.cvtColor(gray // 2 + 64, cv2.COLOR_GRAY2BGR)
+        # 按最大差值归一化，差值为1也清晰可见
+        heat = cv2.applyColorMap((diff.astype(np.float32) * (255.0 / max_diff)).astype(np.uint8),
+                                 cv2.COLORMAP_JET)
+        changed = diff > 0
+        base[changed] = heat[changed]
+        os.makedirs(os.path.dirname(heatmap_path), exist_ok=True)
+        cv2.imencode('.png', base)[1].tofile(heatmap_path)
+        result['heatmap'] = heatmap_path
+    return result
+
+
+def _png_files(directory):
+    return sorted(f for f in os.listdir(directory) if f.lower().endswith('.png')) if os.path.isdir(directory) else []
+
+
+def render_case(mode, template_config, case_dir, output_dir, work_dir):
+    """用指定方式渲染一个用例，返回 (成功数, 总数, 耗时秒)"""
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    start = time.perf_counter()
+    success_count, total = RENDER_MODES[mode](template_config, os.path.join(case_dir, 'templates'),
+                                              os.path.join(case_dir, 'patterns'), output_dir, work_dir)
+    return success_count, total, time.perf_counter() - start
+
+
+class GoldenHarness:
+    def __init__(self, corpus_dir, golden_dir, get_template_config, default_template=None, log_callback=None):
+        """
+        金样图回归检查
+        :param corpus_dir: 语料目录（见 list_cases）
+        :param golden_dir: 金样PNG目录，结构为 <用例>/<输出文件>.png
+        :param get_template_config: 模板键 -> 模板配置
+        :param default_template: case.json 未指定模板时使用的模板键
+        """
+        self.corpus_dir = corpus_dir
+        self.golden_dir = golden_dir
+        self.get_template_config = get_template_config
+        self.default_template = default_template
+        self.log_callback = log_callback or print
+
+    def log(self, message):
+        self.log_callback(message)
+
+    def _config_for(self, info):
+        template_key = info.get('template', self.default_template)
+        config = self.get_template_config(template_key)
+        if config is None:
+            raise ValueError(f"未知模板 '{template_key}'")
+        if info.get('fill_rules'):
+            config = dict(config, fill_rules=dict(config.get('fill_rules', {}), **info['fill_rules']))
+        return config
+
+    def record(self, mode='serial'):
+        """用参考渲染方式生成金样，覆盖已有金样"""
+        manifest = {'mode': mode, 'recorded_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'cases': {}}
+        for name, case_dir, info in list_cases(self.corpus_dir):
+            golden_case_dir = os.path.join(self.golden_dir, name)
+            success_count, total, seconds = render_case(mode, self._config_for(info), case_dir, golden_case_dir,
+                                                        os.path.join(self.golden_dir, '.work', name))
+            manifest['cases'][name] = _png_files(golden_case_dir)
+            self.log(f"金样 {name}: {success_count}/{total} 个文件, 耗时 {seconds:.2f}s")
+        shutil.rmtree(os.path.join(self.golden_dir, '.work'), ignore_errors=True)
+        with open(os.path.join(self.golden_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return manifest
+
+    def check(self, modes, report_dir, tolerance=None):
+        """
+        每种渲染方式渲染全部用例并与金样比对，同时统计吞吐
+        :param modes: 渲染方式列表（见 RENDER_MODES）
+        :param report_dir: 输出、差异热图（<方式>/<用例>/diff/）和 report.json 的目录
+        :return: 报告字典，report['passed'] 为总体结论
+        """
+        tolerance = tolerance or Tolerance()
+        report = {'tolerance': {'max_abs': tolerance.max_abs, 'max_fraction': tolerance.max_fraction},
+                  'modes': {}, 'passed': True}
+        cases = list_cases(self.corpus_dir)
+        for mode in modes:
+            mode_report = {'cases': {}, 'seconds': 0.0, 'files': 0, 'megapixels': 0.0, 'passed': True}
+            for name, case_dir, info in cases:
+                output_dir = os.path.join(report_dir, mode, name)
+                success_count, total, seconds = render_case(mode, self._config_for(info), case_dir, output_dir,
+                                                            os.path.join(report_dir, '.work', mode, name))
+                golden_case_dir = os.path.join(self.golden_dir, name)
+                golden_files = _png_files(golden_case_dir)
+                files = {}
+                for filename in sorted(set(golden_files) | set(_png_files(output_dir))):
+                    golden_path = os.path.join(golden_case_dir, filename)
+                    output_path = os.path.join(output_dir, filename)
+                    if not os.path.exists(golden_path):
+                        files[filename] = {'passed': False, 'reason': "没有金样"}
+                    elif not os.path.exists(output_path):
+                        files[filename] = {'passed': False, 'reason': "没有输出"}
+                    else:
+                        files[filename] = compare_images(
+                            golden_path, output_path, tolerance,
+                            heatmap_path=os.path.join(output_dir, 'diff', filename))
+                        with Image.open(output_path) as image:
+                            mode_report['megapixels'] += image.width * image.height / 1e6
+                case_passed = bool(golden_files) and all(result['passed'] for result in files.values())
+                mode_report['cases'][name] = {'passed': case_passed, 'seconds': seconds,
+                                              'success': success_count, 'total': total, 'files': files}
+                mode_report['seconds'] += seconds
+                mode_report['files'] += total
+                mode_report['passed'] &= case_passed
+
+                worst = max((r.get('max_diff', 255) for r in files.values()), default=0)
+                self.log(f"{'✅' if case_passed else '❌'} [{mode}] {name}: {success_count}/{total} 个文件, "
+                         f"耗时 {seconds:.2f}s, 最大差值 {worst}")
+                for filename, result in files.items():
+                    if not result['passed']:
+                        detail = result.get('reason') or (f"超差像素 {result['bad_fraction']:.4%}, "
+                                                         f"最大差值 {result['max_diff']}")
+                        self.log(f"    {filename}: {detail}")
+
+            mode_report['megapixels_per_second'] = (mode_report['megapixels'] / mode_report['seconds']
+                                                    if mode_report['seconds'] else 0.0)
+            report['modes'][mode] = mode_report
+            report['passed'] &= mode_report['passed']
+            self.log(f"[{mode}] 吞吐: {mode_report['files']} 个文件, {mode_report['seconds']:.2f}s, "
+                     f"{mode_report['megapixels_per_second']:.1f} MP/s")
+
+        shutil.rmtree(os.path.join(report_dir, '.work'), ignore_errors=True)
+        with open(os.path.join(report_dir, 'report.json'), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+
+# ---------- 单项检查（不依赖金样） ----------
+
+def _check_nesting_full_width_rows():
+    """每个裁片都占满整个幅宽时，不限长度的卷料必须把所有裁片排在同一卷上（带间距和不带间距）"""
+    from core.nesting import MarkerNester
+    piece = np.zeros((200, 950, 4), dtype=np.uint8)
+    piece[..., 3] = 255
+    for gap_px in (0, 20):
+        with MarkerNester(1000, gap_px=gap_px, cell_px=10) as nester:
+            for index in range(3):
+                nester.add_piece(f"row{index}", piece)
+            report = nester.pack()
+        assert len(report['rolls']) == 1, f"gap={gap_px}: 排成了 {len(report['rolls'])} 卷"
+        ys = sorted(p['y'] for p in nester.rolls[0]['placements'])
+        assert all(b - a >= 200 + gap_px for a, b in zip(ys, ys[1:])), f"gap={gap_px}: 间距不足 {ys}"
+
+
+def _check_direct_alpha_matches_composite():
+    """无蒙版的普通像素图层：直接解码的透明通道必须与 composite() 的alpha逐像素一致"""
+    import tempfile
+    from psd_tools import PSDImage
+    from psd_tools.api.layers import PixelLayer
+    from core.psd_masks import can_read_alpha_directly, read_layer_alpha
+
+    piece = np.array(_piece_shape(160, 120, 0))
+    yy, xx = np.mgrid[:120, :160]
+    piece[..., 3] = np.minimum(piece[..., 3], (xx * 3 + yy * 5) % 256)  # 软边加渐变，覆盖各种alpha值
+    psd = PSDImage.new('RGBA', (300, 200))
+    layer = PixelLayer.frompil(Image.fromarray(piece, 'RGBA'), psd, 'piece', 30, 50)
+    _strip_user_mask(layer)
+    psd.append(layer)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'piece.psd')
+        psd.save(path)
+        layer = PSDImage.open(path)[0]
+        assert can_read_alpha_directly(layer), "无蒙版像素图层未走快速路径"
+        fast = read_layer_alpha(layer)
+        assert fast is not None, "快速路径读取失败"
+        slow = np.array(layer.composite())[..., 3]
+        assert fast.shape == slow.shape, f"尺寸不一致 {fast.shape} != {slow.shape}"
+        assert np.array_equal(fast, slow), f"{np.count_nonzero(fast != slow)} 个像素不一致"
+
+
+# 检查名 -> 函数，失败时抛出 AssertionError
+SELF_CHECKS = {
+    'nesting_full_width_rows': _check_nesting_full_width_rows,
+    'direct_alpha_matches_composite': _check_direct_alpha_matches_composite,
+}
+
+
+def run_self_checks(log_callback=print):
+    """运行全部单项检查，返回是否全部通过"""
+    passed = True
+    for name, check in SELF_CHECKS.items():
+        try:
+            check()
+            log_callback(f"✅ {name}")
+        except AssertionError as e:
+            passed = False
+            log_callback(f"❌ {name}: {e}")
+    return passed
@@ -0,0 +1,140 @@
+# core/shared_inputs.py - 多进程共享的印花（共享内存，零拷贝只读读取）
+
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def _attach(shm_name):
+    """以只读用途附加到已存在的共享内存，不交由子进程的 resource_tracker 回收"""
+    try:
+        return shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        # Python < 3.13 没有 track 参数：附加时跳过登记。fork 出的子进程与父进程共用同一个
+        # resource_tracker，事后取消登记会删掉父进程的登记，父进程 unlink 时报 KeyError
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=shm_name)
+        finally:
+            resource_tracker.register = register
+
+
+class MaskLayer:
+    """已提取的图层蒙版（提前释放PSD后保留），提供与 psd-tools 图层相同的名称和位置属性"""
+
+    def __init__(self, name, left, top, alpha):
+        self.name = name
+        self.left = left
+        self.top = top
+        self.alpha = alpha
+        self.height, self.width = alpha.shape
+
+
+class SharedInputs:
+    def __init__(self):
+        """
+        批次级共享输入（主进程持有）
+        每个数组只写入共享内存一次，子进程通过 descriptor() 附加读取；
+        引用计数归零时释放全部共享内存
+        模板蒙版每个只被一个子进程使用，不共享，由子进程自行提取
+        """
+        self._blocks = []
+        self._arrays = {}     # 键 -> (共享内存名, 形状, dtype)
+        self._patterns = {}   # (印花路径, 目标尺寸) -> (数组键, 是否缩小解码, 内嵌ICC)
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    def publish(self, key, array):
+        """把数组写入共享内存"""
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        self._blocks.append(shm)
+        self._arrays[key] = (shm.name, array.shape, array.dtype.str)
+
+    def publish_pattern(self, pattern_path, pattern_bgr, target_sizes, reduced=False, icc_profile=None):
+        """
+        发布解码后的印花图案（BGR，未做色彩转换）
+        同一印花按不同目标尺寸缩小解码的比例可能不同，每种解码尺寸发布一份
+        :param target_sizes: 解码出该尺寸的所有目标尺寸，子进程按自己的目标尺寸查找
+        :param reduced: 是否已按目标尺寸缩小解码
+        :param icc_profile: 印花内嵌的ICC，子进程做色彩转换时使用
+        """
+        key = ('pattern', pattern_path, pattern_bgr.shape[1], pattern_bgr.shape[0])
+        self.publish(key, pattern_bgr)
+        for target_size in target_sizes:
+            self._patterns[(pattern_path, target_size)] = (key, reduced, icc_profile)
+
+    def descriptor(self):
+        """可序列化的描述信息，传给子进程"""
+        return {'arrays': dict(self._arrays), 'patterns': dict(self._patterns)}
+
+    @property
+    def nbytes(self):
+        return sum(shm.size for shm in self._blocks)
+
+    def acquire(self):
+        """增加引用（每个使用共享输入的任务一次）"""
+        with self._lock:
+            self._refs += 1
+
+    def release(self):
+        """减少引用，归零时释放共享内存"""
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            blocks, self._blocks = self._blocks, []
+        for shm in blocks:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SharedInputsView:
+    def __init__(self, descriptor):
+        """子进程侧的只读视图，按需附加共享内存并返回NumPy视图"""
+        self._arrays = descriptor['arrays']
+        self._patterns = descriptor['patterns']
+        self._attached = {}
+
+    def array(self, key):
+        """返回共享数组的零拷贝只读视图（所有子进程共用同一份数据），不存在时返回None"""
+        info = self._arrays.get(key)
+        if info is None:
+            return None
+        shm_name, shape, dtype = info
+        shm = self._attached.get(shm_name)
+        if shm is None:
+            shm = self._attached[shm_name] = _attach(shm_name)
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        view.flags.writeable = False
+        return view
+
+    def pattern(self, pattern_path, target_size):
+        """返回按该目标尺寸解码的印花 (BGR视图, 是否缩小解码, 内嵌ICC)，未发布时返回None"""
+        info = self._patterns.get((pattern_path, target_size))
+        if info is None:
+            return None
+        key, reduced, icc_profile = info
+        return self.array(key), reduced, icc_profile
+
+    def close(self):
+        """断开附加（不删除共享内存，由主进程负责）"""
+        attached, self._attached = self._attached, {}
+        for shm in attached.values():
+            try:
+                shm.close()
+            except BufferError:
+                # 仍有视图引用时无法关闭，进程退出时自动释放
+                pass
@@ -0,0 +1,193 @@
+# core/staging.py - 本地暂存：把网络共享上的模板和印花预取到本机磁盘
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_STAGING_DIR = os.path.join('data', 'staging_cache')
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024
+META_SUFFIX = '.stage.json'
+
+
+class StagingCache:
+    def __init__(self, cache_dir=DEFAULT_STAGING_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 block_size=DEFAULT_BLOCK_SIZE, workers=4):
+        """
+        输入文件本地暂存缓存
+        - 按大块顺序读取整个文件复制到本地，避免在SMB上做大量小的随机读
+        - 以源文件的 (大小, mtime) 判断副本是否新鲜
+        - 超出容量时按最近使用时间（记在 .stage.json 的修改时间上，副本本身的mtime不变）淘汰，
+          本批次正在使用的文件不淘汰（子进程继承主进程的保护列表）
+        :param cache_dir: 本地缓存目录（放在SSD上）
+        :param max_bytes: 缓存容量上限（字节）
+        :param block_size: 顺序读取的块大小
+        :param workers: 预取线程数
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.workers = workers
+        self.stats = {'hits': 0, 'copies': 0, 'copied_bytes': 0, 'copy_seconds': 0.0}
+        self._lock = threading.Lock()
+        self._pending = {}   # 源文件绝对路径 -> Future
+        self._pinned = set()  # 本批次使用的本地副本，淘汰时跳过
+        self._executor = None
+        self._total_bytes = None  # 首次需要时才遍历缓存目录统计
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _load_total_bytes(self):
+        """首次需要时遍历缓存目录统计已占用容量"""
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._entries())
+        return self._total_bytes
+
+    @property
+    def total_bytes(self):
+        return self._load_total_bytes()
+
+    def cache_path(self, source_path):
+        """本地副本路径：按源目录分子目录，保留原文件名（日志和输出缓存键都用文件名）"""
+        source_path = os.path.abspath(source_path)
+        directory_key = hashlib.sha1(os.path.dirname(source_path).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, directory_key, os.path.basename(source_path))
+
+    def _is_fresh(self, source_stat, local_path):
+        try:
+            with open(local_path + META_SUFFIX, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return (meta.get('size') == source_stat.st_size and meta.get('mtime_ns') == source_stat.st_mtime_ns
+                and os.path.exists(local_path))
+
+    def _copy(self, source_path, source_stat, local_path):
+        """大块顺序读取复制到临时文件，完成后原子替换并写入新鲜度信息"""
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        tmp_path = f"{local_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        start = time.perf_counter()
+        with open(source_path, 'rb', buffering=0) as src, open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, length=self.block_size)
+        old_size = os.path.getsize(local_path) if os.path.exists(local_path) else 0
+        with self._lock:
+            self._load_total_bytes()  # 替换前完成统计，新文件不会被重复计入
+        os.replace(tmp_path, local_path)
+        with open(local_path + META_SUFFIX, 'w', encoding='utf-8') as f:
+            json.dump({'source': source_path, 'size': source_stat.st_size,
+                       'mtime_ns': source_stat.st_mtime_ns}, f, ensure_ascii=False)
+        with self._lock:
+            self.stats['copies'] += 1
+            self.stats['copied_bytes'] += source_stat.st_size
+            self.stats['copy_seconds'] += time.perf_counter() - start
+            self._total_bytes += source_stat.st_size - old_size
+
+    def stage(self, source_path):
+        """
+        确保源文件在本地有新鲜副本
+        :return: 本地副本路径；源文件不存在或复制失败时返回源路径（由调用方按原逻辑报错）
+        """
+        source_path = os.path.abspath(source_path)
+        local_path = self.cache_path(source_path)
+        try:
+            source_stat = os.stat(source_path)
+            if self._is_fresh(source_stat, local_path):
+                with self._lock:
+                    self.stats['hits'] += 1
+            else:
+                self._copy(source_path, source_stat, local_path)
+                self.evict(keep=local_path)
+            # 最近使用时间记在元数据文件上：副本的mtime参与输出缓存的哈希复用，不能每次都改
+            os.utime(local_path + META_SUFFIX)
+            return local_path
+        except OSError:
+            return source_path
+
+    def prefetch(self, source_paths):
+        """
+        按给定顺序在后台预取（先处理的文件放前面），与处理并行进行
+        新的一批预取开始时，上一批的文件不再受保护
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='staging')
+            self._pinned = {self.cache_path(path) for path in source_paths}
+            for path in source_paths:
+                path = os.path.abspath(path)
+                if path not in self._pending:
+                    self._pending[path] = self._executor.submit(self.stage, path)
+
+    def local_path(self, source_path):
+        """获取用于打开的路径：正在预取的等待其完成，否则立即暂存"""
+        source_path = os.path.abspath(source_path)
+        with self._lock:
+            future = self._pending.pop(source_path, None)
+        if future is not None:
+            return future.result()
+        return self.stage(source_path)
+
+    def _entries(self):
+        """遍历缓存条目 (路径, 大小, 最近使用时间)"""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(META_SUFFIX) or name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                try:
+                    last_used = os.stat(path + META_SUFFIX).st_mtime
+                except OSError:
+                    last_used = st.st_mtime
+                yield path, st.st_size, last_used
+
+    def evict(self, keep=None):
+        """
+        按LRU淘汰，直到缓存不超过容量上限
+        :param keep: 刚复制、马上要打开的副本，不淘汰
+        """
+        if self.total_bytes <= self.max_bytes:
+            return
+        with self._lock:
+            pinned = self._pinned | {keep}
+        for path, size, _ in sorted(self._entries(), key=lambda entry: entry[2]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if path in pinned:
+                continue
+            try:
+                os.remove(path)
+                with self._lock:
+                    self._total_bytes = self.total_bytes - size
+            except OSError:
+                continue
+            try:
+                os.remove(path + META_SUFFIX)
+            except OSError:
+                pass
+
+    def close(self):
+        """等待未完成的预取并结束线程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._pending.clear()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def __getstate__(self):
+        # 子进程只按路径复用已暂存的副本，不继承预取线程；继承保护列表，淘汰时不删主进程本批次预取的文件
+        with self._lock:
+            pinned = set(self._pinned)
+        return {'cache_dir': self.cache_dir, 'max_bytes': self.max_bytes,
+                'block_size': self.block_size, 'workers': self.workers, 'pinned': pinned}
+
+    def __setstate__(self, state):
+        state = dict(state)
+        pinned = state.pop('pinned', set())
+        self.__init__(**state)
+        self._pinned = pinned
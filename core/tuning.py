@@ -0,0 +1,414 @@
+# core/tuning.py - 本机自动调优：按硬件和实测吞吐确定并行数、线程数、PNG压缩级别、条带高度和缓存容量
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import tempfile
+import tracemalloc
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from core.isolation import process_rss
+from core.png_stream import PNGStreamWriter
+from core import output_store, staging
+
+DEFAULT_TUNING_PATH = os.path.join('data', 'tuning.json')
+ENCODE_LEVELS = (1, 3, 6)
+STRIP_ROWS_CANDIDATES = (256, 1024, 4096)
+# 缓存目录都在 data/ 下，各占剩余磁盘空间的一部分
+CACHE_DISK_FRACTION = 0.2
+MIN_CACHE_BYTES = 1024 ** 3
+MAX_CACHE_BYTES = 200 * 1024 ** 3
+# 多一个进程吞吐至少提高这么多才值得（内存和缓存也是成本）
+MIN_SPEEDUP = 1.05
+
+
+class TuningProfile:
+    def __init__(self, workers=1, threads=None, compress_level=6, strip_rows=1024,
+                 output_store_max_bytes=output_store.DEFAULT_MAX_BYTES,
+                 staging_max_bytes=staging.DEFAULT_MAX_BYTES, staging_workers=4,
+                 machine=None, measurements=None):
+        """
+        本机调优配置，默认值即未调优时的行为
+        :param workers: 批量处理的并行进程数
+        :param threads: 单进程时OpenCV的线程数，多进程时平分；None 为不设置
+        :param compress_level: 输出PNG的zlib压缩级别
+        :param strip_rows: 排料长图流式写出的条带高度(行)
+        :param output_store_max_bytes: 输出缓存容量
+        :param staging_max_bytes: 本地暂存容量
+        :param staging_workers: 暂存预取线程数
+        :param machine: 调优时的机器信息，None 表示未调优
+        :param measurements: 校准批次的实测数据（仅供查看）
+        """
+        self.workers = workers
+        self.threads = threads
+        self.compress_level = compress_level
+        self.strip_rows = strip_rows
+        self.output_store_max_bytes = output_store_max_bytes
+        self.staging_max_bytes = staging_max_bytes
+        self.staging_workers = staging_workers
+        self.machine = machine
+        self.measurements = measurements or {}
+
+    @property
+    def tuned(self):
+        return self.machine is not None
+
+    def for_workers(self, workers):
+        """多进程处理时子进程使用的配置：线程数按进程数平分，避免超额订阅CPU"""
+        state = self.to_dict()
+        if self.threads is not None:
+            state['threads'] = max(1, self.threads // max(1, workers))
+        state['measurements'] = None
+        return TuningProfile(**state)
+
+    def apply_threads(self):
+        if self.threads is not None:
+            cv2.setNumThreads(self.threads)
+
+    def to_dict(self):
+        return {'workers': self.workers, 'threads': self.threads, 'compress_level': self.compress_level,
+                'strip_rows': self.strip_rows, 'output_store_max_bytes': self.output_store_max_bytes,
+                'staging_max_bytes': self.staging_max_bytes, 'staging_workers': self.staging_workers,
+                'machine': self.machine, 'measurements': self.measurements}
+
+    def save(self, path=DEFAULT_TUNING_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+def load_tuning(path=DEFAULT_TUNING_PATH):
+    """
+    读取本机调优配置；文件不存在、无效或来自CPU数不同的机器（整个目录拷贝过来）时返回默认配置
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        profile = TuningProfile(**state)
+    except (OSError, ValueError, TypeError):
+        return TuningProfile()
+    if (profile.machine or {}).get('cpu_count') != os.cpu_count():
+        return TuningProfile()
+    return profile
+
+
+def _memory_linux():
+    values = {}
+    with open('/proc/meminfo', 'r') as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            values[key] = int(value.split()[0]) * 1024
+    return values['MemTotal'], values.get('MemAvailable', values['MemFree'])
+
+
+def _memory_windows():
+    import ctypes
+
+    class MEMORYSTATUSEX(ctypes.Structure):
+        _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                    ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                    ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                    ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                    ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+    status = MEMORYSTATUSEX()
+    status.dwLength = ctypes.sizeof(status)
+    if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+        return None
+    return status.ullTotalPhys, status.ullAvailPhys
+
+
+def system_memory():
+    """(物理内存总量, 可用量) 字节，无法获取时返回None"""
+    try:
+        if sys.platform.startswith('linux'):
+            return _memory_linux()
+        if sys.platform == 'win32':
+            return _memory_windows()
+        import psutil
+        memory = psutil.virtual_memory()
+        return memory.total, memory.available
+    except Exception:
+        return None
+
+
+def machine_info():
+    memory = system_memory()
+    return {'hostname': socket.gethostname(), 'platform': platform.platform(),
+            'cpu_count': os.cpu_count(), 'memory_bytes': memory[0] if memory else None}
+
+
+def _calibration_start(_):
+    """预热子进程，返回子进程空闲时的常驻内存"""
+    return process_rss(os.getpid())
+
+
+def _calibration_render(template_config, template_path, pattern_dir, profile):
+    """校准子进程：渲染并编码一个模板（不写文件），返回耗时"""
+    from core.processor import PSDProcessor
+    start = time.perf_counter()
+    processor = PSDProcessor(template_config, lambda message: None, tuning=profile)
+    canvas = processor.render_template(template_path, pattern_dir)
+    if canvas is not None:
+        canvas.save(io.BytesIO(), format='PNG', compress_level=profile.compress_level)
+    return time.perf_counter() - start
+
+
+def _pick_fastest(timings, tolerance=1.05):
+    """耗时最短的候选；与最短相差不超过 tolerance 的取更小的候选（更省资源）"""
+    best = min(timings.values())
+    return min(key for key, seconds in timings.items() if seconds <= best * tolerance)
+
+
+def _clamp(value, low, high):
+    return int(max(low, min(high, value)))
+
+
+class Autotuner:
+    def __init__(self, template_config, template_dir, pattern_dir, sample_files=4, log_callback=None):
+        """
+        用实际模板跑一小批校准，得到本机调优配置
+        :param template_config: 模板配置
+        :param template_dir: PSD模板目录（用真实模板校准）
+        :param pattern_dir: 印花目录
+        :param sample_files: 参与校准的模板数（按文件大小均匀抽样，总包含最大的一个）
+        """
+        self.config = template_config
+        self.template_dir = template_dir
+        self.pattern_dir = pattern_dir
+        self.sample_files = max(1, sample_files)
+        self.log_callback = log_callback or print
+
+    def log(self, message):
+        self.log_callback(message)
+
+    def sample_paths(self):
+        paths = [os.path.join(self.template_dir, name) for name in os.listdir(self.template_dir)
+                 if name.lower().endswith('.psd')]
+        paths.sort(key=os.path.getsize)
+        if len(paths) <= self.sample_files:
+            return paths
+        step = (len(paths) - 1) / (self.sample_files - 1) if self.sample_files > 1 else 0
+        return list(dict.fromkeys(paths[len(paths) - 1 - round(i * step)] for i in range(self.sample_files)))
+
+    def _processor(self, profile=None):
+        from core.processor import PSDProcessor
+        return PSDProcessor(self.config, lambda message: None, tuning=profile or TuningProfile())
+
+    def measure_file(self, path):
+        """单个模板各阶段的耗时、输出PNG各压缩级别的耗时和大小、内存峰值"""
+        processor = self._processor()
+        start = time.perf_counter()
+        (width, height), layers = processor.open_template(path)
+        for layer in layers:
+            processor.extract_layer_alpha(layer)
+        composite_seconds = time.perf_counter() - start
+        del layers
+
+        start = time.perf_counter()
+        canvas = processor.render_template(path, self.pattern_dir)
+        render_seconds = time.perf_counter() - start
+        if canvas is None:
+            return None
+
+        encode = {}
+        for level in ENCODE_LEVELS:
+            buffer = io.BytesIO()
+            start = time.perf_counter()
+            canvas.save(buffer, format='PNG', compress_level=level)
+            encode[level] = {'seconds': time.perf_counter() - start, 'bytes': buffer.tell()}
+        sample_rows = np.array(canvas.convert('RGB'))
+        del canvas
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        processor.pillow_resident_bytes = processor.pillow_transient_bytes = 0
+        try:
+            processor.render_template(path, self.pattern_dir)
+            # Pillow 像素缓冲不经过 tracemalloc，按处理器记录的图像大小补上
+            peak = tracemalloc.get_traced_memory()[1] + \
+                processor.pillow_resident_bytes + processor.pillow_transient_bytes
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+        return {'file': os.path.basename(path), 'megapixels': width * height / 1e6,
+                'composite_seconds': composite_seconds,
+                'resize_seconds': max(0.0, render_seconds - composite_seconds),
+                'encode': encode, 'peak_bytes': peak, 'rows': sample_rows}
+
+    def choose_compress_level(self, files):
+        """
+        压缩级别：在输出不比默认级别(6)大10%以上的前提下选编码最快的
+        （输出常写到网络共享，文件大小与编码时间都要顾及）
+        """
+        seconds = {level: sum(f['encode'][level]['seconds'] for f in files) for level in ENCODE_LEVELS}
+        sizes = {level: sum(f['encode'][level]['bytes'] for f in files) for level in ENCODE_LEVELS}
+        acceptable = [level for level in ENCODE_LEVELS if sizes[level] <= sizes[6] * 1.1]
+        return min(acceptable, key=lambda level: seconds[level]), seconds, sizes
+
+    def measure_threads(self, path):
+        """单进程时不同OpenCV线程数的渲染耗时"""
+        cpu_count = os.cpu_count() or 1
+        candidates = sorted({1, max(1, cpu_count // 4), max(1, cpu_count // 2), cpu_count})
+        original = cv2.getNumThreads()
+        timings = {}
+        try:
+            for threads in candidates:
+                cv2.setNumThreads(threads)
+                processor = self._processor()
+                start = time.perf_counter()
+                processor.render_template(path, self.pattern_dir)
+                timings[threads] = time.perf_counter() - start
+        finally:
+            cv2.setNumThreads(original)
+        return timings
+
+    def measure_scaling(self, paths, threads, compress_level, max_workers):
+        """
+        不同进程数的实际吞吐（文件/秒）：每个进程渲染两个文件；
+        吞吐提升不足 MIN_SPEEDUP 时停止增加
+        :return: ({进程数: 吞吐}, 子进程空闲常驻内存)
+        """
+        candidates = []
+        workers = 1
+        while workers < max_workers:
+            candidates.append(workers)
+            workers *= 2
+        candidates.append(max_workers)
+
+        throughput = {}
+        base_rss = None
+        best = 0.0
+        for workers in dict.fromkeys(candidates):
+            profile = TuningProfile(threads=threads, compress_level=compress_level).for_workers(workers)
+            tasks = [paths[i % len(paths)] for i in range(workers * 2)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                rss = [r for r in executor.map(_calibration_start, range(workers)) if r is not None]
+                if rss:
+                    base_rss = max(base_rss or 0, max(rss))
+                start = time.perf_counter()
+                list(executor.map(_calibration_render, [self.config] * len(tasks), tasks,
+                                  [self.pattern_dir] * len(tasks), [profile] * len(tasks)))
+                throughput[workers] = len(tasks) / (time.perf_counter() - start)
+            self.log(f"  {workers} 个进程: {throughput[workers]:.2f} 文件/秒")
+            if throughput[workers] < best * MIN_SPEEDUP:
+                break
+            best = max(best, throughput[workers])
+        return throughput, base_rss
+
+    def measure_strips(self, rows, compress_level, max_strip_bytes):
+        """排料长图不同条带高度的写出耗时（用校准画布的真实像素拼成长图）"""
+        width = min(rows.shape[1], 8000)
+        rows = np.ascontiguousarray(rows[:, :width])
+        total_rows = max(STRIP_ROWS_CANDIDATES) * 2
+        tiled = np.concatenate([rows] * (total_rows // rows.shape[0] + 1))[:total_rows]
+        timings = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for strip_rows in STRIP_ROWS_CANDIDATES:
+                if strip_rows > STRIP_ROWS_CANDIDATES[0] and strip_rows * width * 3 > max_strip_bytes:
+                    continue
+                start = time.perf_counter()
+                with PNGStreamWriter(os.path.join(tmp_dir, 'strip.png'), width, total_rows,
+                                     compress_level=compress_level) as writer:
+                    for y in range(0, total_rows, strip_rows):
+                        strip = np.full((min(strip_rows, total_rows - y), width, 3), 255, dtype=np.uint8)
+                        np.copyto(strip, tiled[y:y + strip.shape[0]])
+                        writer.write_rows(strip)
+                timings[strip_rows] = time.perf_counter() - start
+        return timings
+
+    def cache_budgets(self):
+        """按 data/ 所在磁盘的剩余空间分配输出缓存和本地暂存容量"""
+        os.makedirs('data', exist_ok=True)
+        free = shutil.disk_usage('data').free
+        budget = _clamp(free * CACHE_DISK_FRACTION, MIN_CACHE_BYTES, MAX_CACHE_BYTES)
+        return budget, budget, free
+
+    def run(self):
+        """运行校准并返回调优配置（不保存）"""
+        paths = self.sample_paths()
+        if not paths:
+            raise ValueError(f"{self.template_dir} 中没有PSD模板")
+        machine = machine_info()
+        cpu_count = machine['cpu_count'] or 1
+        self.log(f"校准: {len(paths)} 个模板, {cpu_count} 个CPU, "
+                 f"内存 {(machine['memory_bytes'] or 0) / 1024 ** 3:.1f} GB")
+
+        files = []
+        for path in paths:
+            result = self.measure_file(path)
+            if result is None:
+                self.log(f"  {os.path.basename(path)}: 没有可用图层，跳过")
+                continue
+            files.append(result)
+            self.log(f"  {result['file']}: {result['megapixels']:.1f} MP, 合成 {result['composite_seconds']:.2f}s, "
+                     f"填充缩放 {result['resize_seconds']:.2f}s, 编码 {result['encode'][6]['seconds']:.2f}s, "
+                     f"内存峰值 {result['peak_bytes'] / 1024 ** 2:.0f} MB")
+        if not files:
+            raise ValueError("校准模板均无法渲染，请检查模板配置和印花目录")
+        megapixels = sum(f['megapixels'] for f in files)
+
+        compress_level, encode_seconds, encode_bytes = self.choose_compress_level(files)
+        self.log(f"PNG压缩级别: {compress_level} (" + ", ".join(
+            f"{level}: {encode_seconds[level]:.2f}s/{encode_bytes[level] / 1024 ** 2:.1f} MB"
+            for level in ENCODE_LEVELS) + ")")
+
+        largest = max(files, key=lambda f: f['megapixels'])
+        thread_timings = self.measure_threads(os.path.join(self.template_dir, largest['file']))
+        threads = _pick_fastest(thread_timings)
+        self.log(f"OpenCV线程数: {threads} (" + ", ".join(
+            f"{t}: {s:.2f}s" for t, s in thread_timings.items()) + ")")
+
+        # 进程数上限：CPU数，以及可用内存能容纳的进程数（留20%余量）
+        peak = max(f['peak_bytes'] for f in files)
+        memory = system_memory()
+        own_rss = process_rss(os.getpid()) or 0
+        memory_limit = cpu_count
+        if memory is not None:
+            memory_limit = max(1, int(memory[1] * 0.8 // (peak + own_rss)))
+        throughput, base_rss = self.measure_scaling([os.path.join(self.template_dir, f['file']) for f in files],
+                                                    threads, compress_level, min(cpu_count, memory_limit))
+        workers = _pick_fastest({w: 1 / files_per_second for w, files_per_second in throughput.items()})
+        if memory is not None and base_rss:
+            workers = min(workers, max(1, int(memory[1] * 0.8 // (peak + base_rss))))
+        self.log(f"并行进程数: {workers} (内存可容纳 {memory_limit} 个)")
+
+        max_strip_bytes = (memory[1] // 16) if memory is not None else 256 * 1024 ** 2
+        strip_timings = self.measure_strips(largest['rows'], compress_level, max_strip_bytes)
+        strip_rows = _pick_fastest(strip_timings)
+        self.log(f"排料条带高度: {strip_rows} 行 (" + ", ".join(
+            f"{rows}: {s:.2f}s" for rows, s in strip_timings.items()) + ")")
+
+        output_store_bytes, staging_bytes, free = self.cache_budgets()
+        staging_workers = min(8, max(2, cpu_count // 2))
+        self.log(f"输出缓存 {output_store_bytes / 1024 ** 3:.1f} GB, 本地暂存 {staging_bytes / 1024 ** 3:.1f} GB "
+                 f"(剩余磁盘 {free / 1024 ** 3:.1f} GB), 预取线程 {staging_workers}")
+
+        measurements = {
+            'files': [{key: value for key, value in f.items() if key != 'rows'} for f in files],
+            'composite_mp_per_s': megapixels / max(1e-9, sum(f['composite_seconds'] for f in files)),
+            'resize_mp_per_s': megapixels / max(1e-9, sum(f['resize_seconds'] for f in files)),
+            'encode_mp_per_s': megapixels / max(1e-9, encode_seconds[compress_level]),
+            'peak_bytes': peak,
+            'worker_base_rss_bytes': base_rss,
+            'threads_seconds': thread_timings,
+            'workers_files_per_s': throughput,
+            'strip_seconds': strip_timings,
+            'disk_free_bytes': free,
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        return TuningProfile(workers=workers, threads=threads, compress_level=compress_level,
+                             strip_rows=strip_rows, output_store_max_bytes=output_store_bytes,
+                             staging_max_bytes=staging_bytes, staging_workers=staging_workers,
+                             machine=machine, measurements=measurements)
@@ -1,11 +1,17 @@
 # gui/main_window.py - 主窗口
 
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import ttk, filedialog, messagebox, simpledialog
 import threading
 import os
-from config.templates import get_template_list, get_template_config, get_template_display_name
+from config.templates import get_template_list, get_template_config, get_template_display_name, get_template_errors
 from core.processor import PSDProcessor
+from core.output_store import OutputStore
+from core.preflight import PreflightScanner, format_report, has_problems
+from core.color import ColorManager
+from core.staging import StagingCache
+from core.isolation import IsolationPolicy
+from core.tuning import Autotuner, load_tuning, DEFAULT_TUNING_PATH
 
 class MainWindow:
     def __init__(self, root, license_manager):
@@ -15,8 +21,18 @@ class MainWindow:
         self.root.title("PSD印花处理工具 v1.0")
         self.root.geometry("700x500")
         
+        # 本机调优配置：并行数默认值、缓存容量等
+        self.tuning = load_tuning()
+        
         self.setup_ui()
         self.load_settings()
+        
+        if self.tuning.tuned:
+            self.log_message(f"已加载本机调优配置: 并行进程数 {self.tuning.workers}, "
+                             f"PNG压缩级别 {self.tuning.compress_level}")
+        
+        for template_key, error in get_template_errors().items():
+            self.log_message(f"模板 {template_key}.json 无效，已忽略: {error}")
     
     def setup_ui(self):
         """设置主界面"""
@@ -62,6 +78,12 @@ class MainWindow:
         tk.Entry(path_frame, textvariable=self.output_dir_var, width=50).grid(row=2, column=1, padx=10, pady=8)
         tk.Button(path_frame, text="浏览", command=self.browse_output_dir).grid(row=2, column=2, padx=10, pady=8)
         
+        # 打印机ICC（可选，留空不做色彩管理）
+        tk.Label(path_frame, text="打印机ICC(可选):").grid(row=3, column=0, sticky="w", padx=10, pady=8)
+        self.printer_profile_var = tk.StringVar()
+        tk.Entry(path_frame, textvariable=self.printer_profile_var, width=50).grid(row=3, column=1, padx=10, pady=8)
+        tk.Button(path_frame, text="浏览", command=self.browse_printer_profile).grid(row=3, column=2, padx=10, pady=8)
+        
         # 处理控制区域
         control_frame = tk.LabelFrame(main_frame, text="处理控制", font=("Arial", 10, "bold"))
         control_frame.pack(fill="both", expand=True)
@@ -89,10 +111,59 @@ class MainWindow:
         self.log_text.pack(side="left", fill="both", expand=True)
         log_scrollbar.pack(side="right", fill="y")
         
+        # 输出缓存与并行
+        option_frame = tk.Frame(control_frame)
+        option_frame.pack(fill="x", padx=10)
+        
+        self.use_output_store_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(option_frame, text="复用相同输入的已有输出（输出缓存）",
+                       variable=self.use_output_store_var).pack(side="left")
+        
+        self.use_staging_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(option_frame, text="输入先暂存到本地（网络共享）",
+                       variable=self.use_staging_var).pack(side="left")
+        
+        self.workers_var = tk.IntVar(value=self.tuning.workers)
+        tk.Spinbox(option_frame, from_=1, to=max(1, os.cpu_count() or 1), width=4,
+                   textvariable=self.workers_var).pack(side="right")
+        tk.Label(option_frame, text="并行进程数:").pack(side="right")
+        
+        self.memory_budget_var = tk.StringVar(value="")
+        tk.Entry(option_frame, textvariable=self.memory_budget_var, width=7).pack(side="right", padx=(0, 10))
+        tk.Label(option_frame, text="单文件内存预算MB(留空不限):").pack(side="right")
+        
+        # 故障隔离
+        isolation_frame = tk.Frame(control_frame)
+        isolation_frame.pack(fill="x", padx=10, pady=(5, 0))
+        
+        self.use_isolation_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(isolation_frame, text="隔离模式（每个文件在子进程中处理，损坏文件不影响整批）",
+                       variable=self.use_isolation_var).pack(side="left")
+        
+        self.isolation_rss_var = tk.StringVar(value="")
+        tk.Entry(isolation_frame, textvariable=self.isolation_rss_var, width=7).pack(side="right")
+        tk.Label(isolation_frame, text="单文件内存上限MB(留空不限):").pack(side="right")
+        
+        self.isolation_timeout_var = tk.StringVar(value="600")
+        tk.Entry(isolation_frame, textvariable=self.isolation_timeout_var, width=6).pack(side="right", padx=(0, 10))
+        tk.Label(isolation_frame, text="单文件超时(秒):").pack(side="right")
+        
         # 处理按钮
-        self.process_button = tk.Button(control_frame, text="开始处理", command=self.start_processing,
+        button_frame = tk.Frame(control_frame)
+        button_frame.pack(pady=15)
+        
+        tk.Label(button_frame, text="预览比例:").pack(side="left")
+        self.preview_scale_var = tk.StringVar(value="0.1")
+        ttk.Combobox(button_frame, textvariable=self.preview_scale_var, width=6,
+                     values=["0.05", "0.1", "0.2", "0.25"]).pack(side="left", padx=(5, 10))
+        
+        self.preview_button = tk.Button(button_frame, text="快速预览", command=self.start_preview,
+                                       font=("Arial", 12))
+        self.preview_button.pack(side="left", padx=10)
+        
+        self.process_button = tk.Button(button_frame, text="开始处理", command=self.start_processing,
                                        bg="#4CAF50", fg="white", font=("Arial", 12, "bold"))
-        self.process_button.pack(pady=15)
+        self.process_button.pack(side="left", padx=10)
     
     def create_menu(self):
         """创建菜单栏"""
@@ -107,6 +178,12 @@ class MainWindow:
         file_menu.add_separator()
         file_menu.add_command(label="退出", command=self.root.quit)
         
+        # 工具菜单
+        tools_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="工具", menu=tools_menu)
+        tools_menu.add_command(label="排料到卷料...", command=self.start_marker)
+        tools_menu.add_command(label="本机自动调优", command=self.start_autotune)
+        
         # 帮助菜单
         help_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="帮助", menu=help_menu)
@@ -131,6 +208,44 @@ class MainWindow:
         if directory:
             self.output_dir_var.set(directory)
     
+    def browse_printer_profile(self):
+        """浏览打印机ICC文件"""
+        path = filedialog.askopenfilename(title="选择打印机ICC",
+                                          filetypes=[("ICC描述文件", "*.icc *.icm"), ("所有文件", "*.*")])
+        if path:
+            self.printer_profile_var.set(path)
+    
+    def create_color_manager(self):
+        """按设置的打印机ICC创建色彩管理，未设置返回None"""
+        profile_path = self.printer_profile_var.get().strip()
+        return ColorManager(profile_path) if profile_path else None
+    
+    def create_output_store(self):
+        """按界面选项和本机调优的容量创建输出缓存"""
+        if not self.use_output_store_var.get():
+            return None
+        return OutputStore(max_bytes=self.tuning.output_store_max_bytes)
+    
+    def create_staging_cache(self):
+        """按界面选项和本机调优的容量创建本地暂存"""
+        if not self.use_staging_var.get():
+            return None
+        return StagingCache(max_bytes=self.tuning.staging_max_bytes, workers=self.tuning.staging_workers)
+    
+    def create_isolation_policy(self):
+        """根据界面选项创建隔离策略，未启用隔离模式返回None"""
+        if not self.use_isolation_var.get():
+            return None
+        try:
+            timeout = float(self.isolation_timeout_var.get())
+        except ValueError:
+            timeout = 600
+        try:
+            max_rss_mb = float(self.isolation_rss_var.get()) if self.isolation_rss_var.get().strip() else None
+        except ValueError:
+            max_rss_mb = None
+        return IsolationPolicy(timeout=timeout, max_rss_mb=max_rss_mb)
+    
     def log_message(self, message):
         """添加日志消息"""
         self.log_text.insert(tk.END, message + "\n")
@@ -146,45 +261,214 @@ class MainWindow:
                 return get_template_config(template_key)
         return None
     
-    def start_processing(self):
-        """开始处理"""
-        # 验证输入
+    def validate_inputs(self):
+        """验证输入，返回模板配置，验证失败返回None"""
         if not self.template_dir_var.get():
             messagebox.showerror("错误", "请选择PSD模板目录")
-            return
+            return None
         
         if not self.pattern_dir_var.get():
             messagebox.showerror("错误", "请选择印花图案目录")
-            return
+            return None
         
         if not os.path.exists(self.template_dir_var.get()):
             messagebox.showerror("错误", "PSD模板目录不存在")
-            return
+            return None
         
         if not os.path.exists(self.pattern_dir_var.get()):
             messagebox.showerror("错误", "印花图案目录不存在")
-            return
+            return None
+        
+        profile_path = self.printer_profile_var.get().strip()
+        if profile_path and not os.path.isfile(profile_path):
+            messagebox.showerror("错误", "打印机ICC文件不存在")
+            return None
         
         # 获取模板配置
         template_config = self.get_selected_template_config()
         if not template_config:
             messagebox.showerror("错误", "无效的模板配置")
+            return None
+        
+        return template_config
+    
+    def start_preview(self):
+        """开始生成低分辨率预览"""
+        template_config = self.validate_inputs()
+        if not template_config:
+            return
+        
+        try:
+            scale = float(self.preview_scale_var.get())
+        except ValueError:
+            scale = 0
+        if not 0 < scale <= 1:
+            messagebox.showerror("错误", "预览比例必须在0到1之间")
+            return
+        
+        self.preview_button.config(state="disabled")
+        self.process_button.config(state="disabled")
+        self.progress_bar.start()
+        self.log_text.delete(1.0, tk.END)
+        self.status_var.set("生成预览...")
+        
+        thread = threading.Thread(target=self.preview_files, args=(template_config, scale))
+        thread.daemon = True
+        thread.start()
+    
+    def preview_files(self, template_config, scale):
+        """生成预览（在单独线程中运行）"""
+        try:
+            processor = PSDProcessor(template_config, self.log_message,
+                                     color_manager=self.create_color_manager(),
+                                     staging_cache=self.create_staging_cache(), tuning=self.tuning)
+            previews = processor.render_previews(
+                self.template_dir_var.get(),
+                self.pattern_dir_var.get(),
+                scale=scale
+            )
+            
+            self.root.after(0, lambda: self.status_var.set(f"预览完成 - 共 {len(previews)} 个尺码"))
+            if previews:
+                self.root.after(0, lambda: self.show_previews(previews))
+        
+        except Exception as e:
+            error = str(e)
+            self.root.after(0, lambda: self.log_message(f"生成预览时发生错误: {error}"))
+            self.root.after(0, lambda: self.status_var.set("预览失败"))
+        
+        finally:
+            self.root.after(0, lambda: (
+                self.preview_button.config(state="normal"),
+                self.process_button.config(state="normal"),
+                self.progress_bar.stop()
+            ))
+    
+    def show_previews(self, previews):
+        """在新窗口中显示预览缩略图"""
+        from PIL import ImageTk
+        
+        window = tk.Toplevel(self.root)
+        window.title("预览")
+        
+        thumb_size = 320
+        columns = 3
+        window.photos = []  # 保持引用，防止图片被回收
+        for index, (filename, image) in enumerate(previews):
+            thumb = image.copy()
+            thumb.thumbnail((thumb_size, thumb_size))
+            photo = ImageTk.PhotoImage(thumb)
+            window.photos.append(photo)
+            
+            cell = tk.Frame(window)
+            cell.grid(row=index // columns, column=index % columns, padx=8, pady=8)
+            tk.Label(cell, image=photo, relief="solid", borderwidth=1).pack()
+            tk.Label(cell, text=filename).pack()
+    
+    def start_marker(self):
+        """把当前目录所有尺码的裁片排到卷料上"""
+        template_config = self.validate_inputs()
+        if not template_config:
             return
         
-        # 检查印花文件是否存在
-        pattern_dir = self.pattern_dir_var.get()
-        missing_files = []
-        for pattern_file in template_config['pattern_files']:
-            if not os.path.exists(os.path.join(pattern_dir, pattern_file)):
-                missing_files.append(pattern_file)
+        roll_width_mm = simpledialog.askfloat("排料", "卷料幅宽(mm):", initialvalue=1600, minvalue=100)
+        if not roll_width_mm:
+            return
+        dpi = simpledialog.askinteger("排料", "模板打印分辨率(DPI):", initialvalue=150, minvalue=10)
+        if not dpi:
+            return
         
-        if missing_files:
-            messagebox.showwarning("警告", f"以下印花文件不存在:\n{', '.join(missing_files)}\n\n将跳过相应的图层处理")
+        template_dir = self.template_dir_var.get()
+        jobs = [(os.path.join(template_dir, f), self.pattern_dir_var.get())
+                for f in sorted(os.listdir(template_dir)) if f.lower().endswith('.psd')]
+        
+        self.process_button.config(state="disabled")
+        self.preview_button.config(state="disabled")
+        self.progress_bar.start()
+        self.log_text.delete(1.0, tk.END)
+        self.status_var.set("排料中...")
+        
+        def run():
+            try:
+                processor = PSDProcessor(template_config, self.log_message,
+                                         color_manager=self.create_color_manager(), tuning=self.tuning)
+                paths, _ = processor.build_markers(jobs, self.output_dir_var.get(), roll_width_mm, dpi)
+                self.root.after(0, lambda: self.status_var.set(f"排料完成 - 共 {len(paths)} 卷"))
+            except Exception as e:
+                error = str(e)
+                self.root.after(0, lambda: self.log_message(f"排料失败: {error}"))
+                self.root.after(0, lambda: self.status_var.set("排料失败"))
+            finally:
+                self.root.after(0, lambda: (
+                    self.process_button.config(state="normal"),
+                    self.preview_button.config(state="normal"),
+                    self.progress_bar.stop()
+                ))
+        
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+    
+    def start_autotune(self):
+        """用当前模板目录跑一小批校准，保存本机调优配置并立即生效"""
+        template_config = self.validate_inputs()
+        if not template_config:
+            return
+        
+        self.process_button.config(state="disabled")
+        self.preview_button.config(state="disabled")
+        self.progress_bar.start()
+        self.log_text.delete(1.0, tk.END)
+        self.status_var.set("自动调优中...")
+        
+        def run():
+            try:
+                profile = Autotuner(template_config, self.template_dir_var.get(), self.pattern_dir_var.get(),
+                                    log_callback=self.log_message).run()
+                profile.save(DEFAULT_TUNING_PATH)
+                self.tuning = profile
+                self.root.after(0, lambda: (
+                    self.workers_var.set(profile.workers),
+                    self.status_var.set(f"调优完成 - 并行进程数 {profile.workers}")
+                ))
+            except Exception as e:
+                error = str(e)
+                self.root.after(0, lambda: self.log_message(f"自动调优失败: {error}"))
+                self.root.after(0, lambda: self.status_var.set("自动调优失败"))
+            finally:
+                self.root.after(0, lambda: (
+                    self.process_button.config(state="normal"),
+                    self.preview_button.config(state="normal"),
+                    self.progress_bar.stop()
+                ))
+        
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+    
+    def start_processing(self):
+        """开始处理"""
+        template_config = self.validate_inputs()
+        if not template_config:
+            return
+        
+        # 预检：只读取PSD文件头和图层记录，提前发现缺失图层、尺码和规则问题
+        self.log_text.delete(1.0, tk.END)
+        report = PreflightScanner(template_config).scan_directory(
+            self.template_dir_var.get(), self.pattern_dir_var.get())
+        if has_problems(report):
+            lines = format_report(report)
+            for line in lines:
+                self.log_message(line)
+            problems = [line for line in lines if not line.startswith("✅")]
+            if not messagebox.askyesno("预检发现问题", "\n".join(problems[:15]) +
+                                       ("\n..." if len(problems) > 15 else "") + "\n\n是否继续处理？"):
+                return
         
         # 禁用处理按钮
         self.process_button.config(state="disabled", text="处理中...")
+        self.preview_button.config(state="disabled")
         self.progress_bar.start()
-        self.log_text.delete(1.0, tk.END)
         self.status_var.set("开始处理...")
         
         # 在新线程中处理
@@ -195,14 +479,29 @@ class MainWindow:
     def process_files(self, template_config):
         """处理文件（在单独线程中运行）"""
         try:
+            try:
+                workers = max(1, int(self.workers_var.get()))
+            except (tk.TclError, ValueError):
+                workers = 1
+            
+            try:
+                memory_budget_mb = float(self.memory_budget_var.get()) if self.memory_budget_var.get().strip() else None
+            except ValueError:
+                memory_budget_mb = None
+            
             # 创建处理器
-            processor = PSDProcessor(template_config, self.log_message)
+            processor = PSDProcessor(template_config, self.log_message, output_store=self.create_output_store(),
+                                     memory_budget_mb=memory_budget_mb,
+                                     color_manager=self.create_color_manager(),
+                                     staging_cache=self.create_staging_cache(), tuning=self.tuning)
             
             # 执行批量处理
             success_count, total_count = processor.process_directory(
                 self.template_dir_var.get(),
                 self.pattern_dir_var.get(),
-                self.output_dir_var.get()
+                self.output_dir_var.get(),
+                workers=workers,
+                isolation=self.create_isolation_policy()
             )
             
             # 更新状态
@@ -221,6 +520,7 @@ class MainWindow:
             # 重新启用处理按钮
             self.root.after(0, lambda: (
                 self.process_button.config(state="normal", text="开始处理"),
+                self.preview_button.config(state="normal"),
                 self.progress_bar.stop()
             ))
     
@@ -232,8 +532,18 @@ class MainWindow:
                 'template_dir': self.template_dir_var.get(),
                 'pattern_dir': self.pattern_dir_var.get(),
                 'output_dir': self.output_dir_var.get(),
-                'selected_template': self.template_var.get()
+                'selected_template': self.template_var.get(),
+                'use_output_store': self.use_output_store_var.get(),
+                'use_staging': self.use_staging_var.get(),
+                'memory_budget_mb': self.memory_budget_var.get(),
+                'printer_profile': self.printer_profile_var.get(),
+                'use_isolation': self.use_isolation_var.get(),
+                'isolation_timeout': self.isolation_timeout_var.get(),
+                'isolation_max_rss_mb': self.isolation_rss_var.get()
             }
+            # 并行进程数只在用户改过本机调优值时保存，否则启动时继续跟随调优配置
+            if self.workers_var.get() != self.tuning.workers:
+                settings['workers'] = self.workers_var.get()
             
             os.makedirs('data', exist_ok=True)
             with open('data/settings.json', 'w', encoding='utf-8') as f:
@@ -255,6 +565,18 @@ class MainWindow:
                 self.template_dir_var.set(settings.get('template_dir', ''))
                 self.pattern_dir_var.set(settings.get('pattern_dir', ''))
                 self.output_dir_var.set(settings.get('output_dir', 'output'))
+                self.use_output_store_var.set(settings.get('use_output_store', False))
+                self.use_staging_var.set(settings.get('use_staging', False))
+                # 保存设置之后重新调优过（调优配置更新）时以调优结果为准
+                tuning_newer = self.tuning.tuned and os.path.exists(DEFAULT_TUNING_PATH) and \
+                    os.path.getmtime(DEFAULT_TUNING_PATH) > os.path.getmtime(settings_file)
+                workers = settings.get('workers')
+                self.workers_var.set(self.tuning.workers if workers is None or tuning_newer else workers)
+                self.memory_budget_var.set(settings.get('memory_budget_mb', ''))
+                self.printer_profile_var.set(settings.get('printer_profile', ''))
+                self.use_isolation_var.set(settings.get('use_isolation', False))
+                self.isolation_timeout_var.set(settings.get('isolation_timeout', '600'))
+                self.isolation_rss_var.set(settings.get('isolation_max_rss_mb', ''))
                 
                 # 设置模板选择
                 selected_template = settings.get('selected_template', '')
@@ -0,0 +1,43 @@
+import sys
+import os
+import argparse
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config.templates import get_template_list, get_template_config
+from core.processor import PSDProcessor
+from core.color import ColorManager, INTENTS, benchmark_color_stage
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="色彩管理耗时对比：印花阶段转换 vs 整幅画布转换")
+    parser.add_argument("templates", help="PSD模板目录")
+    parser.add_argument("patterns", help="印花图案目录")
+    parser.add_argument("printer_profile", help="打印机ICC文件（RGB）")
+    parser.add_argument("--source-profile", help="印花源ICC，默认sRGB")
+    parser.add_argument("--intent", default="perceptual", choices=list(INTENTS))
+    parser.add_argument("--template", default=get_template_list()[0],
+                        help=f"模板键，可选: {', '.join(get_template_list())}")
+    args = parser.parse_args()
+
+    template_config = get_template_config(args.template)
+    if template_config is None:
+        sys.exit(f"错误: 未知模板 '{args.template}'")
+
+    color_manager = ColorManager(args.printer_profile, args.source_profile, intent=args.intent)
+    processor = PSDProcessor(template_config, lambda message: None, color_manager=color_manager)
+
+    psd_files = sorted(f for f in os.listdir(args.templates) if f.lower().endswith('.psd'))
+    total_pattern, total_canvas = 0.0, 0.0
+    for filename in psd_files:
+        result = benchmark_color_stage(processor, os.path.join(args.templates, filename), args.patterns)
+        if result is None:
+            print(f"{filename}: 没有可用图层，跳过")
+            continue
+        total_pattern += result['convert_seconds']
+        total_canvas += result['canvas_seconds']
+        print(f"{filename}: 印花/裁片阶段 {result['converted_images']} 张 "
+              f"{result['converted_pixels'] / 1e6:.1f} MP, 转换 {result['convert_seconds'] * 1000:.0f} ms | "
+              f"整幅画布 {result['canvas_pixels'] / 1e6:.1f} MP, 转换 {result['canvas_seconds'] * 1000:.0f} ms | "
+              f"总耗时 {result['pattern_render_seconds']:.2f}s vs {result['canvas_render_seconds']:.2f}s")
+    if total_pattern > 0:
+        print(f"合计: 印花/裁片阶段 {total_pattern:.2f}s, 整幅画布 {total_canvas:.2f}s "
+              f"({total_canvas / total_pattern:.1f}x)")
@@ -0,0 +1,34 @@
+import sys
+import os
+import argparse
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config.templates import get_template_list, get_template_config
+from core.preflight import PreflightScanner, read_psd_layers, format_report, has_problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PSD模板预检（只读取文件头和图层记录）")
+    parser.add_argument("path", help="PSD模板目录，或单个PSD文件（列出全部图层）")
+    parser.add_argument("--template", default=get_template_list()[0],
+                        help=f"模板键，可选: {', '.join(get_template_list())}")
+    parser.add_argument("--patterns", help="印花图案目录（检查印花文件是否齐全）")
+    args = parser.parse_args()
+
+    if os.path.isfile(args.path):
+        info = read_psd_layers(args.path)
+        print(f"画布: {info['width']}x{info['height']}, 位深: {info['depth']}, 图层数: {len(info['layers'])}")
+        for layer in info['layers']:
+            group = f"{layer['group_path']}/" if layer['group_path'] else ""
+            print(f"- {group}{layer['name']}  类型: {layer['kind']}  可见: {layer['visible']}  "
+                  f"尺寸: {layer['width']}x{layer['height']}  位置: ({layer['left']}, {layer['top']})  "
+                  f"可渲染: {layer['renderable']}")
+        sys.exit(0)
+
+    template_config = get_template_config(args.template)
+    if template_config is None:
+        sys.exit(f"错误: 未知模板 '{args.template}'")
+
+    report = PreflightScanner(template_config).scan_directory(args.path, args.patterns)
+    for line in format_report(report):
+        print(line)
+    sys.exit(1 if has_problems(report) else 0)
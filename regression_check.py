@@ -0,0 +1,59 @@
+import sys
+import os
+import argparse
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config.templates import TEMPLATE_CONFIGS, get_template_list, get_template_config
+from core.regression import GoldenHarness, Tolerance, RENDER_MODES, build_synthetic_corpus, run_self_checks
+
+DEFAULT_ROOT = os.path.join('data', 'regression')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="金样图回归检查：各渲染方式与金样逐像素比对并统计吞吐")
+    parser.add_argument("--corpus", default=os.path.join(DEFAULT_ROOT, 'corpus'), help="语料目录")
+    parser.add_argument("--golden", default=os.path.join(DEFAULT_ROOT, 'golden'), help="金样目录")
+    parser.add_argument("--template", default=get_template_list()[0],
+                        help=f"用例未指定模板时使用的模板键，可选: {', '.join(get_template_list())}")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    corpus_parser = subparsers.add_parser("corpus", help="为模板生成合成语料（大印花/小印花/平铺/跨缩小比例四组）")
+    corpus_parser.add_argument("templates", nargs="*", help="模板键，默认全部内置模板")
+
+    record_parser = subparsers.add_parser("record", help="用参考方式生成金样")
+    record_parser.add_argument("--mode", default="serial", choices=list(RENDER_MODES))
+
+    check_parser = subparsers.add_parser("check", help="各渲染方式与金样比对")
+    check_parser.add_argument("--modes", default=",".join(RENDER_MODES),
+                              help=f"逗号分隔，可选: {', '.join(RENDER_MODES)}")
+    check_parser.add_argument("--max-abs", type=int, default=0, help="单像素允许的最大通道差值")
+    check_parser.add_argument("--max-fraction", type=float, default=0.0, help="超出 max-abs 的像素允许比例")
+    check_parser.add_argument("--report", default=os.path.join(DEFAULT_ROOT, 'report'),
+                              help="输出、差异热图和报告目录")
+    subparsers.add_parser("selfcheck", help="运行不依赖金样的单项检查")
+    args = parser.parse_args()
+
+    if args.command == "selfcheck":
+        sys.exit(0 if run_self_checks() else 1)
+
+    if args.command == "corpus":
+        keys = args.templates or list(TEMPLATE_CONFIGS)
+        configs = {key: get_template_config(key) for key in keys}
+        unknown = [key for key, config in configs.items() if config is None]
+        if unknown:
+            sys.exit(f"错误: 未知模板 {', '.join(unknown)}")
+        build_synthetic_corpus(args.corpus, configs)
+        print(f"已生成语料: {args.corpus}")
+        sys.exit(0)
+
+    harness = GoldenHarness(args.corpus, args.golden, get_template_config, default_template=args.template)
+    if args.command == "record":
+        harness.record(args.mode)
+        sys.exit(0)
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in RENDER_MODES]
+    if unknown:
+        sys.exit(f"错误: 未知渲染方式 {', '.join(unknown)}")
+    report = harness.check(modes, args.report, Tolerance(args.max_abs, args.max_fraction))
+    print("✅ 全部通过" if report['passed'] else f"❌ 存在差异，详见 {os.path.join(args.report, 'report.json')}")
+    sys.exit(0 if report['passed'] else 1)
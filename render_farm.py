@@ -0,0 +1,54 @@
+import sys
+import os
+import argparse
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config.templates import get_template_list, get_template_config
+from core.processor import PSDProcessor
+from core.output_store import OutputStore
+from core.color import ColorManager
+from core.staging import StagingCache
+from core.job_queue import JobQueue, RenderNode, default_node_id
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多机渲染：通过共享目录分发PSD任务")
+    parser.add_argument("queue_dir", help="共享队列目录（所有节点都能访问）")
+    parser.add_argument("--lease-timeout", type=float, default=60, help="租约超时(秒)，超时未心跳的任务重新分配")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    node_parser = subparsers.add_parser("node", help="作为渲染节点运行，循环领取任务")
+    node_parser.add_argument("--node-id", default=default_node_id(), help="节点名称，默认 主机名-进程号")
+    node_parser.add_argument("--exit-when-idle", action="store_true", help="队列为空时退出")
+
+    submit_parser = subparsers.add_parser("submit", help="发布一个批次并等待所有节点处理完成")
+    submit_parser.add_argument("templates", help="PSD模板目录（共享路径）")
+    submit_parser.add_argument("patterns", help="印花图案目录（共享路径）")
+    submit_parser.add_argument("output", help="输出目录（共享路径）")
+    submit_parser.add_argument("--template", default=get_template_list()[0],
+                               help=f"模板键，可选: {', '.join(get_template_list())}")
+    submit_parser.add_argument("--output-store", action="store_true", help="各节点使用本机输出缓存")
+    submit_parser.add_argument("--staging", action="store_true", help="各节点先把输入暂存到本机磁盘")
+    submit_parser.add_argument("--memory-budget-mb", type=float, help="单文件内存预算(MB)，峰值超出的文件中止并记为失败")
+    submit_parser.add_argument("--printer-profile", help="打印机ICC文件（共享路径）")
+    submit_parser.add_argument("--timeout", type=float, help="最长等待时间(秒)，默认一直等到全部完成")
+    args = parser.parse_args()
+
+    queue = JobQueue(args.queue_dir, lease_timeout=args.lease_timeout)
+
+    if args.command == "node":
+        RenderNode(queue, node_id=args.node_id).run(exit_when_idle=args.exit_when_idle)
+        sys.exit(0)
+
+    template_config = get_template_config(args.template)
+    if template_config is None:
+        sys.exit(f"错误: 未知模板 '{args.template}'")
+
+    processor = PSDProcessor(template_config,
+                             output_store=OutputStore() if args.output_store else None,
+                             memory_budget_mb=args.memory_budget_mb,
+                             staging_cache=StagingCache() if args.staging else None,
+                             color_manager=ColorManager(args.printer_profile) if args.printer_profile else None)
+    success_count, total = queue.process_directory(processor, os.path.abspath(args.templates),
+                                                   os.path.abspath(args.patterns), os.path.abspath(args.output),
+                                                   timeout=args.timeout)
+    sys.exit(0 if total and success_count == total else 1)